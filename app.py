@@ -1,27 +1,57 @@
 import os
+import sys
 import time
 import json
 import jwt
+import click
 import requests
 import hashlib
+import base64
+import codecs
+import random
+import threading
+import uuid
+import socket
+import gzip
+import re
+import tempfile
+import csv
+import io
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, as_completed, FIRST_COMPLETED
 from datetime import datetime, timedelta, timezone
-from flask import Flask, render_template, request, jsonify, session, flash, redirect, url_for, send_file
-from sqlalchemy import create_engine, text
-from sqlalchemy.exc import SQLAlchemyError
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from flask import Flask, render_template, request, jsonify, session, flash, redirect, url_for, Response, stream_with_context
+from sqlalchemy import (create_engine, text, bindparam, event, MetaData, Table, Column, Index,
+                        Integer, String, Date, Numeric, Text, DateTime)
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError, OperationalError, TimeoutError as PoolTimeoutError
 from dotenv import load_dotenv
 from urllib.parse import urlparse, urlunparse
 
+try:
+    import brotli  # opcional: variantes .br no cache de páginas estáticas
+except ImportError:
+    brotli = None
+
 # Carregar variáveis de ambiente
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "chave-secreta-padrao-demo")
 
-# Configuração do Banco de Dados (MariaDB/MySQL)
+# Configuração do Banco de Dados (MariaDB/MySQL ou SQLite para rodar localmente)
 def normalize_db_url(raw_url: str) -> str:
     try:
         parsed = urlparse(raw_url)
         scheme = parsed.scheme.lower()
+        # SQLite: sqlite:///arquivo.db, sqlite:////caminho/absoluto.db,
+        # sqlite:// ou sqlite:///:memory: (em memória)
+        if scheme.startswith("sqlite"):
+            return raw_url.strip()
         # Força uso do dialeto MariaDB com pymysql, compatível com MariaDB 10.x/11.x
         if scheme.startswith("mysql"):
             scheme = "mariadb+pymysql"
@@ -36,65 +66,758 @@ def normalize_db_url(raw_url: str) -> str:
     except Exception:
         return raw_url
 
+def is_sqlite_memory_url(url: str) -> bool:
+    path = url.split("://", 1)[-1]
+    return path in ("", "/", "/:memory:") or "mode=memory" in path
+
+# Pool de conexões: dimensionar para (workers do gunicorn x threads) <= max_connections do banco
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # < wait_timeout do MariaDB
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+
+# Profiler de queries (eventos do engine) e log de queries lentas
+DB_PROFILER_ENABLED = os.getenv("DB_PROFILER", "1") == "1"
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "500"))
+DB_PROFILER_MAX_STATEMENTS = int(os.getenv("DB_PROFILER_MAX_STATEMENTS", "500"))
+
+def pool_options():
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_pre_ping": DB_POOL_PRE_PING
+    }
+
+def build_engine(url: str):
+    if not url.startswith("sqlite"):
+        return create_engine(url, **pool_options())
+    if is_sqlite_memory_url(url):
+        # Cada conexão nova seria um banco vazio: uma única conexão, emprestada a
+        # uma thread por vez (as outras esperam no pool até DB_POOL_TIMEOUT)
+        return create_engine(url, connect_args={"check_same_thread": False}, poolclass=QueuePool,
+                             pool_size=1, max_overflow=0, pool_timeout=DB_POOL_TIMEOUT)
+    sqlite_engine = create_engine(url, connect_args={"check_same_thread": False, "timeout": 30}, **pool_options())
+
+    @event.listens_for(sqlite_engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _record):
+        # WAL permite leituras concorrentes com um escritor (workers/threads)
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+    return sqlite_engine
+
 DATABASE_URL = normalize_db_url(os.getenv("DATABASE_URL") or "")
 engine = None
 if DATABASE_URL and DATABASE_URL.strip():
     try:
-        engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+        engine = build_engine(DATABASE_URL)
     except Exception as e:
         print(f"Erro ao configurar DB: {e}")
 
+def is_sqlite():
+    return engine is not None and engine.dialect.name == 'sqlite'
+
+# Fragmentos SQL que variam entre MariaDB/MySQL e SQLite
+def sql_concat(*parts):
+    return " || ".join(parts) if is_sqlite() else f"CONCAT({', '.join(parts)})"
+
+def sql_cast_text(expr, length=200):
+    return f"CAST({expr} AS TEXT)" if is_sqlite() else f"CAST({expr} AS CHAR({length}))"
+
+def sql_for_update():
+    # SQLite serializa escritas no nível do banco; não há SELECT ... FOR UPDATE
+    return "" if is_sqlite() else "FOR UPDATE"
+
+def sql_upsert_add(table, key_columns, add_columns):
+    # INSERT que soma nos contadores quando a chave já existe (atômico nos dois bancos)
+    columns = key_columns + add_columns
+    insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)})"
+    if is_sqlite():
+        sets = ", ".join(f"{c} = {c} + excluded.{c}" for c in add_columns)
+        return f"{insert} ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET {sets}"
+    sets = ", ".join(f"{c} = {c} + VALUES({c})" for c in add_columns)
+    return f"{insert} ON DUPLICATE KEY UPDATE {sets}"
+
+def sql_insert_ignore(table, columns):
+    # INSERT que não faz nada quando a chave já existe
+    into = f"INTO {table} ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)})"
+    return f"INSERT OR IGNORE {into}" if is_sqlite() else f"INSERT IGNORE {into}"
+
+def sql_upsert_min(table, key_columns, min_column):
+    # INSERT que mantém o menor valor de min_column quando a chave já existe
+    columns = key_columns + [min_column]
+    insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)})"
+    if is_sqlite():
+        return (f"{insert} ON CONFLICT ({', '.join(key_columns)}) "
+                f"DO UPDATE SET {min_column} = MIN({min_column}, excluded.{min_column})")
+    return f"{insert} ON DUPLICATE KEY UPDATE {min_column} = LEAST({min_column}, VALUES({min_column}))"
+
+def server_version(conn):
+    if is_sqlite():
+        return "SQLite " + conn.execute(text("SELECT sqlite_version()")).scalar()
+    return conn.execute(text("SELECT VERSION()")).scalar()
+
+# Profiler de queries: contagem, histograma de latência e linhas por statement,
+# mais estatísticas de checkout/espera do pool. Valores por processo.
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+def new_histogram():
+    return [0] * (len(LATENCY_BUCKETS_MS) + 1)  # último balde: acima do maior limite
+
+def observe_histogram(histogram, value_ms):
+    for i, bound in enumerate(LATENCY_BUCKETS_MS):
+        if value_ms <= bound:
+            histogram[i] += 1
+            return
+    histogram[-1] += 1
+
+def histogram_dict(histogram):
+    labels = [f"le_{bound}ms" for bound in LATENCY_BUCKETS_MS] + ["inf"]
+    return dict(zip(labels, histogram))
+
+# Listas de placeholders (IN expandido, VALUES multi-linha) viram "(...)" para agrupar statements iguais
+_PLACEHOLDER_GROUP = re.compile(r"\(\s*(?:\?|%s|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|:\w+))*\s*\)")
+_REPEATED_GROUPS = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+
+def normalize_statement(statement):
+    key = " ".join(statement.split())
+    key = _REPEATED_GROUPS.sub("(...)", _PLACEHOLDER_GROUP.sub("(...)", key))
+    return key[:300]
+
+# Chamada a cada statement executado: o cache evita repetir as regex para o mesmo
+# SQL. Statements longos (INSERT multi-linha, IN grandes) ficam fora para não
+# prender memória
+_cached_statement_key = lru_cache(maxsize=1024)(normalize_statement)
+
+def statement_key(statement):
+    if len(statement) > 2000:
+        return normalize_statement(statement)
+    return _cached_statement_key(statement)
+
+class CountingFetchStrategy:
+    """Envolve a estratégia de fetch de um resultado e conta as linhas lidas.
+
+    SELECT não tem rowcount confiável (SQLite devolve -1), então as linhas
+    são contadas quando o código realmente as busca.
+    """
+    __slots__ = ("_inner", "_record")
+
+    def __init__(self, inner, record):
+        self._inner = inner
+        self._record = record
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+    def fetchone(self, result, dbapi_cursor, hard_close=False):
+        row = self._inner.fetchone(result, dbapi_cursor, hard_close)
+        if row is not None:
+            self._record(1)
+        return row
+
+    def fetchmany(self, result, dbapi_cursor, size=None):
+        rows = self._inner.fetchmany(result, dbapi_cursor, size)
+        self._record(len(rows))
+        return rows
+
+    def fetchall(self, result, dbapi_cursor):
+        rows = self._inner.fetchall(result, dbapi_cursor)
+        self._record(len(rows))
+        return rows
+
+    def yield_per(self, result, dbapi_cursor, num):
+        # yield_per troca a estratégia do resultado: envolve a nova também
+        self._inner.yield_per(result, dbapi_cursor, num)
+        result.cursor_strategy = CountingFetchStrategy(result.cursor_strategy, self._record)
+
+class QueryProfiler:
+    def __init__(self, slow_query_ms=500.0, max_statements=500):
+        self.slow_query_ms = slow_query_ms
+        self.max_statements = max_statements
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = datetime.now(timezone.utc)
+            self.statements = {}
+            self.slow_queries = deque(maxlen=50)
+            self.pool = {
+                "connects": 0, "checkouts": 0, "checkins": 0, "invalidations": 0,
+                "wait_total_ms": 0.0, "wait_max_ms": 0.0, "wait_timeouts": 0,
+                "wait_histogram": new_histogram()
+            }
+
+    def attach(self, target_engine):
+        event.listen(target_engine, "before_cursor_execute", self._before_execute)
+        event.listen(target_engine, "after_cursor_execute", self._after_execute)
+        event.listen(target_engine, "after_execute", self._on_result)
+        event.listen(target_engine, "handle_error", self._on_error)
+        # Listeners do pool passam para o pool novo no dispose(); o cronômetro de
+        # espera não, então é reinstalado pelo evento engine_disposed
+        event.listen(target_engine.pool, "connect", lambda *_: self._count("connects"))
+        event.listen(target_engine.pool, "checkout", lambda *_: self._count("checkouts"))
+        event.listen(target_engine.pool, "checkin", lambda *_: self._count("checkins"))
+        event.listen(target_engine.pool, "invalidate", lambda *_: self._count("invalidations"))
+        event.listen(target_engine, "engine_disposed", lambda eng: self._time_pool_waits(eng.pool))
+        self._time_pool_waits(target_engine.pool)
+
+    def _time_pool_waits(self, pool):
+        # O pool não emite evento no início da espera: mede o tempo de pool.connect()
+        pool_connect = pool.connect
+
+        def timed_connect():
+            started = time.perf_counter()
+            try:
+                return pool_connect()
+            except PoolTimeoutError:
+                self._count("wait_timeouts")  # só estouro de DB_POOL_TIMEOUT; falha de conexão não conta
+                raise
+            finally:
+                self._observe_wait((time.perf_counter() - started) * 1000)
+        pool.connect = timed_connect
+
+    def _count(self, name):
+        with self._lock:
+            self.pool[name] += 1
+
+    def _observe_wait(self, elapsed_ms):
+        with self._lock:
+            self.pool["wait_total_ms"] += elapsed_ms
+            self.pool["wait_max_ms"] = max(self.pool["wait_max_ms"], elapsed_ms)
+            observe_histogram(self.pool["wait_histogram"], elapsed_ms)
+
+    def _stats_for(self, statement):
+        key = statement_key(statement)
+        stats = self.statements.get(key)
+        if stats is None:
+            if len(self.statements) >= self.max_statements:
+                key = "<outros statements>"
+                stats = self.statements.get(key)
+            if stats is None:
+                stats = {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0, "rows": 0,
+                         "histogram": new_histogram()}
+                self.statements[key] = stats
+        return stats
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context._profiler_started = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - context._profiler_started) * 1000
+        # DML: linhas afetadas. SELECT: contadas no fetch (_on_result), rowcount não é confiável
+        returns_rows = cursor.description is not None
+        rows = 0 if returns_rows or not cursor.rowcount or cursor.rowcount < 0 else cursor.rowcount
+        with self._lock:
+            stats = self._stats_for(statement)
+            stats["count"] += 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+            stats["rows"] += rows
+            observe_histogram(stats["histogram"], elapsed_ms)
+        if elapsed_ms >= self.slow_query_ms:
+            compact = " ".join(statement.split())
+            self.slow_queries.append({
+                "at": datetime.now(timezone.utc).isoformat(),
+                "ms": round(elapsed_ms, 1),
+                "rows": None if returns_rows else rows,
+                "statement": compact[:1000]
+            })
+            detail = "" if returns_rows else f", {rows} linhas"
+            print(f"Query lenta ({elapsed_ms:.1f} ms{detail}): {compact[:500]}")
+
+    def _on_result(self, conn, clauseelement, multiparams, params, execution_options, result):
+        if not getattr(result, "returns_rows", False) or not hasattr(result, "cursor_strategy"):
+            return
+        with self._lock:
+            stats = self._stats_for(result.context.statement)
+
+        def record(n):
+            with self._lock:
+                stats["rows"] += n
+        result.cursor_strategy = CountingFetchStrategy(result.cursor_strategy, record)
+
+    def _on_error(self, exception_context):
+        if exception_context.statement:
+            with self._lock:
+                self._stats_for(exception_context.statement)["errors"] += 1
+
+    def snapshot(self, top=20, order_by="total_ms"):
+        with self._lock:
+            statements = [
+                {
+                    "statement": key,
+                    "count": stats["count"],
+                    "errors": stats["errors"],
+                    "rows": stats["rows"],
+                    "total_ms": round(stats["total_ms"], 3),
+                    "avg_ms": round(stats["total_ms"] / stats["count"], 3) if stats["count"] else 0.0,
+                    "max_ms": round(stats["max_ms"], 3),
+                    "histogram": histogram_dict(stats["histogram"])
+                }
+                for key, stats in self.statements.items()
+            ]
+            pool = dict(self.pool, wait_histogram=histogram_dict(self.pool["wait_histogram"]))
+            slow = list(self.slow_queries)
+            started_at = self.started_at
+        statements.sort(key=lambda item: item[order_by], reverse=True)
+        pool["wait_total_ms"] = round(pool["wait_total_ms"], 3)
+        pool["wait_max_ms"] = round(pool["wait_max_ms"], 3)
+        pool["wait_avg_ms"] = round(pool["wait_total_ms"] / pool["checkouts"], 3) if pool["checkouts"] else 0.0
+        return {
+            "since": started_at.isoformat(),
+            "distinct_statements": len(statements),
+            "statements": statements[:top],
+            "slow_queries": slow,
+            "pool_events": pool
+        }
+
+query_profiler = QueryProfiler(slow_query_ms=DB_SLOW_QUERY_MS, max_statements=DB_PROFILER_MAX_STATEMENTS)
+if engine is not None and DB_PROFILER_ENABLED:
+    query_profiler.attach(engine)
+
+def pool_status():
+    pool = engine.pool
+    status = {"class": type(pool).__name__, "status": pool.status()}
+    # NullPool/StaticPool não têm todos os contadores
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        fn = getattr(pool, name, None)
+        if callable(fn):
+            status[name] = fn()
+    if not is_sqlite_memory_url(DATABASE_URL):
+        status["config"] = pool_options()
+    return status
+
+# Métricas HTTP e da drenagem em formato Prometheus (/metrics)
+# Cada worker do gunicorn grava um snapshot em METRICS_DIR; o /metrics soma todos.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_DIR = os.getenv("METRICS_DIR") or os.path.join(tempfile.gettempdir(), "msf-metrics")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "1"))
+HTTP_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+METRIC_HELP = {
+    "http_request_duration_seconds": ("histogram", "Latência das requisições HTTP por endpoint, método e status."),
+    "http_requests_in_flight": ("gauge", "Requisições HTTP em andamento por endpoint."),
+    "process_orders_runs_total": ("counter", "Execuções da drenagem de pedidos por modo."),
+    "process_orders_orders_total": ("counter", "Pedidos tratados pela drenagem por resultado."),
+    "process_orders_confirm_attempts_total": ("counter", "Chamadas de confirmação feitas pela drenagem."),
+    "process_orders_retries_total": ("counter", "Novas tentativas de confirmação após erro."),
+    "confirm_http_requests_total": ("counter", "Chamadas HTTP ao serviço de confirmação por resultado."),
+    "confirm_http_seconds_total": ("counter", "Tempo total gasto nas chamadas HTTP de confirmação."),
+}
+
+class MetricsRegistry:
+    """Contadores em memória do processo; o snapshot vai para um arquivo por processo.
+
+    O arquivo leva pid e um token da instância, então um pid reaproveitado
+    não sobrescreve o snapshot de um worker encerrado: histogramas e contadores
+    deles continuam somados (monotônicos) até o diretório ser limpo na próxima
+    subida (reset_metrics_dir). O gauge de requisições em andamento só conta
+    processos vivos.
+    """
+
+    def __init__(self, directory, flush_interval=1.0, enabled=True):
+        self.enabled = enabled
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._histograms = {}   # (endpoint, method, status) -> [count, sum, buckets...]
+        self._in_flight = {}    # endpoint -> n
+        self._counters = {}     # (name, labels ordenados) -> valor
+        self._pid = None
+        self._path = None
+        self._started_at = None
+        self._dirty = threading.Event()
+
+    def _ensure_flusher(self):
+        # Com gunicorn --preload a thread do master não sobrevive ao fork: uma por pid
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._started_at = time.time()
+            self._path = os.path.join(self.directory, f"{self._pid}-{uuid.uuid4().hex[:8]}.json")
+            os.makedirs(self.directory, exist_ok=True)
+            threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            self._dirty.wait()
+            self._dirty.clear()
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Erro ao gravar métricas: {e}")
+            time.sleep(self.flush_interval)
+
+    def request_started(self, endpoint):
+        self._ensure_flusher()
+        with self._lock:
+            self._in_flight[endpoint] = self._in_flight.get(endpoint, 0) + 1
+        self._dirty.set()
+
+    def request_finished(self, endpoint, method, status, seconds):
+        key = (endpoint, method, str(status))
+        with self._lock:
+            self._in_flight[endpoint] -= 1
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [0, 0.0] + [0] * len(HTTP_LATENCY_BUCKETS)
+            hist[0] += 1
+            hist[1] += seconds
+            for i, bound in enumerate(HTTP_LATENCY_BUCKETS):
+                if seconds <= bound:
+                    hist[2 + i] += 1
+                    break
+        self._dirty.set()
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        self._ensure_flusher()
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._dirty.set()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "started_at": self._started_at,
+                "histograms": [[*key, *values] for key, values in self._histograms.items()],
+                "in_flight": dict(self._in_flight),
+                "counters": [[name, dict(labels), value] for (name, labels), value in self._counters.items()]
+            }
+
+    def flush(self):
+        snapshot = self.snapshot()
+        tmp_path = f"{self._path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self._path)
+
+    def collect(self):
+        """Soma os snapshots de todos os workers (o deste processo vem da memória)."""
+        own = self.snapshot()
+        snapshots = [own]
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            names = []
+        own_name = os.path.basename(self._path) if self._path else None
+        for name in names:
+            if not name.endswith(".json") or name == own_name:
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # arquivo sendo substituído ou corrompido: fica para o próximo scrape
+
+        # pid reaproveitado: só o snapshot mais recente daquele pid pode ser do processo vivo
+        latest = {}
+        for snap in snapshots:
+            started_at = snap.get("started_at") or 0
+            if started_at >= latest.get(snap["pid"], (0, None))[0]:
+                latest[snap["pid"]] = (started_at, snap)
+        histograms, in_flight, counters = {}, {}, {}
+        for snap in snapshots:
+            if snap["pid"] == own["pid"]:
+                alive = snap is own
+            else:
+                alive = latest[snap["pid"]][1] is snap and pid_alive(snap["pid"])
+            for endpoint, method, status, *values in snap["histograms"]:
+                total = histograms.setdefault((endpoint, method, status), [0] * len(values))
+                for i, value in enumerate(values):
+                    total[i] += value
+            if alive:
+                for endpoint, n in snap["in_flight"].items():
+                    in_flight[endpoint] = in_flight.get(endpoint, 0) + n
+            for name, labels, value in snap["counters"]:
+                key = (name, tuple(sorted(labels.items())))
+                counters[key] = counters.get(key, 0) + value
+        return histograms, in_flight, counters
+
+def reset_metrics_dir(directory):
+    """Apaga os snapshots da execução anterior; chamar na subida, antes dos workers."""
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return 0
+    removed = 0
+    for name in names:
+        if name.endswith((".json", ".tmp")):
+            try:
+                os.remove(os.path.join(directory, name))
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def prometheus_labels(**labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels.items()) + "}"
+
+def render_prometheus(histograms, in_flight, counters):
+    lines = []
+
+    def header(name):
+        kind, help_text = METRIC_HELP[name]
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    header("http_request_duration_seconds")
+    for (endpoint, method, status), values in sorted(histograms.items()):
+        count, total, buckets = values[0], values[1], values[2:]
+        cumulative = 0
+        for bound, n in zip(HTTP_LATENCY_BUCKETS, buckets):
+            cumulative += n
+            labels = prometheus_labels(endpoint=endpoint, method=method, status=status, le=bound)
+            lines.append(f"http_request_duration_seconds_bucket{labels} {cumulative}")
+        labels = prometheus_labels(endpoint=endpoint, method=method, status=status, le="+Inf")
+        lines.append(f"http_request_duration_seconds_bucket{labels} {count}")
+        labels = prometheus_labels(endpoint=endpoint, method=method, status=status)
+        lines.append(f"http_request_duration_seconds_sum{labels} {total:.6f}")
+        lines.append(f"http_request_duration_seconds_count{labels} {count}")
+
+    header("http_requests_in_flight")
+    for endpoint, n in sorted(in_flight.items()):
+        lines.append(f"http_requests_in_flight{prometheus_labels(endpoint=endpoint)} {n}")
+
+    for name in ("process_orders_runs_total", "process_orders_orders_total",
+                 "process_orders_confirm_attempts_total", "process_orders_retries_total",
+                 "confirm_http_requests_total", "confirm_http_seconds_total"):
+        header(name)
+        for (counter_name, labels), value in sorted(counters.items()):
+            if counter_name == name:
+                lines.append(f"{name}{prometheus_labels(**dict(labels)) if labels else ''} {value}")
+    return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry(METRICS_DIR, METRICS_FLUSH_INTERVAL, enabled=METRICS_ENABLED)
+
+def metrics_endpoint_label():
+    # Regra da rota (ex.: /api/orders/<int:order_id>/confirm): cardinalidade limitada
+    return request.url_rule.rule if request.url_rule is not None else "<sem rota>"
+
+@app.before_request
+def metrics_before_request():
+    if not metrics.enabled:
+        return
+    request.environ["msf.metrics.started"] = time.perf_counter()
+    request.environ["msf.metrics.endpoint"] = metrics_endpoint_label()
+    metrics.request_started(request.environ["msf.metrics.endpoint"])
+
+@app.after_request
+def metrics_after_request(response):
+    started = request.environ.get("msf.metrics.started")
+    if started is None:
+        return response
+    endpoint = request.environ["msf.metrics.endpoint"]
+    method = request.method
+    status = response.status_code
+    # Fecha na entrega do último byte: respostas em streaming medem a duração inteira
+    response.call_on_close(lambda: metrics.request_finished(endpoint, method, status, time.perf_counter() - started))
+    return response
+
+@app.route('/metrics')
+def metrics_view():
+    if not metrics.enabled:
+        return jsonify({"error": "Métricas desabilitadas (METRICS_ENABLED=0)"}), 404
+    body = render_prometheus(*metrics.collect())
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
 # Configuração Mock API
 API_TOKEN = os.getenv("API_TOKEN", "token-ficticio-123")
-MOCK_API_BASE_URL = "https://jsonplaceholder.typicode.com" # Usando JSONPlaceholder para simular
+MOCK_API_BASE_URL = os.getenv("MOCK_API_BASE_URL", "https://jsonplaceholder.typicode.com").rstrip("/")
+
+# Cliente de confirmação: local (simulado no processo) | http (POST em MOCK_API_BASE_URL)
+CONFIRM_CLIENT_MODE = os.getenv("CONFIRM_CLIENT_MODE", "local")
+CONFIRM_LOCAL_FAILURE_RATE = float(os.getenv("CONFIRM_LOCAL_FAILURE_RATE", "0.2"))  # falhas simuladas no modo local
+CONFIRM_HTTP_POOL_SIZE = int(os.getenv("CONFIRM_HTTP_POOL_SIZE", "16"))  # conexões keep-alive por processo
+CONFIRM_HTTP_CONNECT_TIMEOUT = float(os.getenv("CONFIRM_HTTP_CONNECT_TIMEOUT", "2"))
+CONFIRM_HTTP_READ_TIMEOUT = float(os.getenv("CONFIRM_HTTP_READ_TIMEOUT", "5"))
+
+# Configuração do processamento de pedidos (/api/process-orders)
+PROCESS_MODE = os.getenv("PROCESS_ORDERS_MODE", "sequential")  # sequential | concurrent
+PROCESS_MAX_WORKERS = int(os.getenv("PROCESS_ORDERS_MAX_WORKERS", "8"))
+PROCESS_DEADLINE_SECONDS = float(os.getenv("PROCESS_ORDERS_DEADLINE", "25"))
+PROCESS_STREAM_SUMMARY_EVERY = 50  # resumo parcial a cada N pedidos no modo streaming
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+
+# UPDATE em massa (/demo/5 e reset-status): single (um statement) | chunked
+BULK_UPDATE_MODE = os.getenv("BULK_UPDATE_MODE", "single")
+BULK_UPDATE_BATCH_SIZE = int(os.getenv("BULK_UPDATE_BATCH_SIZE", "1000"))
+BULK_UPDATE_SLEEP_SECONDS = float(os.getenv("BULK_UPDATE_SLEEP_MS", "0")) / 1000
+CONFIRM_MAX_ATTEMPTS = 3
+CONFIRM_BACKOFF_BASE = 0.1
+CONFIRM_BACKOFF_MAX = 2.0
+CONFIRM_BATCH_CHUNK_SIZE = int(os.getenv("CONFIRM_BATCH_CHUNK_SIZE", "500"))
+CONFIRM_BATCH_MAX_ITEMS = int(os.getenv("CONFIRM_BATCH_MAX_ITEMS", "10000"))
+
+# Circuit breaker das confirmações (compartilhado pelas execuções do processo)
+CB_ENABLED = os.getenv("CB_ENABLED", "1") == "1"
+# Janela grande o bastante para a falha simulada de 20% (mock_api_confirm) nunca abrir o circuito
+CB_WINDOW = int(os.getenv("CB_WINDOW", "100"))                # últimas N chamadas avaliadas
+CB_MIN_CALLS = int(os.getenv("CB_MIN_CALLS", "50"))           # mínimo de chamadas na janela para abrir
+CB_FAILURE_RATE = float(os.getenv("CB_FAILURE_RATE", "0.5"))  # taxa de falha que abre o circuito
+CB_OPEN_SECONDS = float(os.getenv("CB_OPEN_SECONDS", "5"))    # tempo aberto antes do half-open
+CB_HALF_OPEN_PROBES = int(os.getenv("CB_HALF_OPEN_PROBES", "3"))
+CB_MAX_WAIT_SECONDS = float(os.getenv("CB_MAX_WAIT_SECONDS", "10"))  # espera máxima seguida sem o circuito fechar
+
+# Concorrência adaptativa do modo concurrent (AIMD sobre taxa de erro e latência)
+ADAPTIVE_CONCURRENCY = os.getenv("ADAPTIVE_CONCURRENCY", "1") == "1"
+CONFIRM_LATENCY_TARGET_MS = float(os.getenv("CONFIRM_LATENCY_TARGET_MS", "500"))
+CONFIRM_ERROR_RATE_TARGET = float(os.getenv("CONFIRM_ERROR_RATE_TARGET", "0.3"))
+
+# Idempotência do confirm: memory (por processo) | table (entre workers)
+IDEMPOTENCY_STORE = os.getenv("IDEMPOTENCY_STORE", "memory")
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+
+# Listagem paginada de /demo/5 e exportação em streaming (/api/orders/export)
+DEMO_ORDERS_PAGE_SIZE = int(os.getenv("DEMO_ORDERS_PAGE_SIZE", "50"))
+EXPORT_YIELD_PER = int(os.getenv("EXPORT_YIELD_PER", "1000"))  # linhas por lote lido do cursor no servidor
+ANALYTICS_DEFAULT_DAYS = int(os.getenv("ANALYTICS_DEFAULT_DAYS", "30"))  # janela de /api/analytics sem from
+
+# Cache de leitura das páginas de /api/orders (invalidado por geração a cada escrita)
+ORDERS_CACHE_ENABLED = os.getenv("ORDERS_CACHE_ENABLED", "1") == "1"
+ORDERS_CACHE_TTL_SECONDS = float(os.getenv("ORDERS_CACHE_TTL", "5"))
+ORDERS_CACHE_MAX_ENTRIES = int(os.getenv("ORDERS_CACHE_MAX_ENTRIES", "256"))
+
+# Normalização em lote (normalize_users_batch / flask normalize-users)
+NORMALIZE_CHUNK_SIZE = int(os.getenv("NORMALIZE_CHUNK_SIZE", "50000"))
+NORMALIZE_MAX_REJECTED = 1000  # IDs rejeitados listados no resumo do streaming
+NORMALIZE_MAX_RECORD_SIZE = int(os.getenv("NORMALIZE_MAX_RECORD_SIZE", str(1024 * 1024)))  # caracteres por registro
+KEY_FN_CACHE_SIZE = int(os.getenv("KEY_FN_CACHE_SIZE", "65536"))  # cache LRU do key_fn (deep_key_map_iter)
+
+# Cache de páginas/arquivos estáticos (/responses, /responses/notion, /static/p1-oauth.png)
+ASSET_CHECK_INTERVAL = float(os.getenv("ASSET_CHECK_INTERVAL", "2"))  # segundos entre os stat() de mtime
+ASSET_MAX_AGE = int(os.getenv("ASSET_MAX_AGE", "60"))  # Cache-Control max-age enviado ao navegador
+
+# Índice de grafo em memória para /demo/3 (GRAPH_INDEX_ENABLED=1 torna padrão)
+GRAPH_INDEX_ENABLED = os.getenv("GRAPH_INDEX_ENABLED", "0") == "1"
+GRAPH_INDEX_TTL_SECONDS = float(os.getenv("GRAPH_INDEX_TTL", "60"))
+
+# Tabela de fecho transitivo de Relacionamentos (CLOSURE_ENABLED=1 mantém a cada escrita)
+CLOSURE_ENABLED = os.getenv("CLOSURE_ENABLED", "0") == "1"
+CLOSURE_MAX_DEPTH = int(os.getenv("CLOSURE_MAX_DEPTH", "6"))  # caminhos mais longos não são guardados
+CLOSURE_ANY_TYPE = '*'  # tipo_relacao das linhas que valem para qualquer tipo de aresta
 
 # -------------------------------------------------------------------
 # Helper Functions (Lógica das Perguntas)
 # -------------------------------------------------------------------
 
 # Pergunta 7: Normalização de Usuários
+TAG_CACHE_MAX = 100000
+_tag_cache = {}
+
+def normalize_tag(raw):
+    # Tags se repetem muito entre registros: guarda a forma normalizada
+    # (internada) de cada string bruta para não refazer strip/lower
+    if not isinstance(raw, str):
+        return str(raw).strip().lower()
+    tag = _tag_cache.get(raw)
+    if tag is None:
+        tag = sys.intern(raw.strip().lower())
+        if len(_tag_cache) < TAG_CACHE_MAX:
+            _tag_cache[raw] = tag
+    return tag
+
+def normalize_user(user):
+    """Normaliza um registro; retorna None quando o id é inválido."""
+    try:
+        user_id = int(user.get('id'))
+    except (ValueError, TypeError):
+        return None
+
+    # split() sem argumento já remove as bordas e colapsa espaços internos
+    name = ' '.join([word.capitalize() for word in user.get('name', '').split()])
+
+    email = user.get('email', '').strip().lower()
+
+    active_val = user.get('active')
+    if isinstance(active_val, bool):
+        active = active_val
+    elif isinstance(active_val, str):
+        active = active_val.lower() in ('true', '1', 'yes', 'on')
+    elif isinstance(active_val, (int, float)):
+        active = bool(active_val)
+    else:
+        active = False
+
+    tags_val = user.get('tags', [])
+    cached = _tag_cache.get
+    if isinstance(tags_val, str):
+        tags = {cached(t) or normalize_tag(t) for t in tags_val.split(',') if t.strip()}
+    elif isinstance(tags_val, (list, tuple)):
+        tags = {(cached(t) if type(t) is str else None) or normalize_tag(t) for t in tags_val if t}
+    else:
+        tags = ()
+
+    return {
+        'id': user_id,
+        'name': name,
+        'email': email,
+        'active': active,
+        'tags': sorted(tags)
+    }
+
 def normalize_users(input_list):
     normalized = []
+    append = normalized.append
     for user in input_list:
-        try:
-            user_id = int(user.get('id'))
-        except (ValueError, TypeError):
-            continue
-        
-        name = user.get('name', '').strip()
-        name = ' '.join(name.split())
-        name = ' '.join(word.capitalize() for word in name.split())
-        
-        email = user.get('email', '').strip().lower()
-        
-        active_val = user.get('active')
-        if isinstance(active_val, bool):
-            active = active_val
-        elif isinstance(active_val, str):
-            active = active_val.lower() in ('true', '1', 'yes', 'on')
-        elif isinstance(active_val, (int, float)):
-            active = bool(active_val)
-        else:
-            active = False
-            
-        tags_val = user.get('tags', [])
-        if isinstance(tags_val, str):
-            tags = [t.strip().lower() for t in tags_val.split(',') if t.strip()]
-        elif isinstance(tags_val, (list, tuple)):
-            tags = [str(t).strip().lower() for t in tags_val if t]
-        else:
-            tags = []
-        tags = sorted(list(set(tags)))
-        
-        normalized.append({
-            'id': user_id,
-            'name': name,
-            'email': email,
-            'active': active,
-            'tags': tags
-        })
+        record = normalize_user(user)
+        if record is not None:
+            append(record)
     return normalized
 
+def normalize_users_batch(input_list, workers=None, chunk_size=NORMALIZE_CHUNK_SIZE):
+    """Normaliza entradas grandes em blocos num pool de processos.
+
+    Mesma saída (e mesma ordem) de normalize_users. Retorna (normalized, stats),
+    com stats incluindo records_per_second. Entradas pequenas rodam no
+    processo atual, onde o custo de serializar os blocos não compensa.
+    """
+    started = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    total = len(input_list)
+    if workers <= 1 or total <= chunk_size:
+        normalized = normalize_users(input_list)
+        workers = 1
+    else:
+        chunks = (input_list[i:i + chunk_size] for i in range(0, total, chunk_size))
+        normalized = []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for part in pool.map(normalize_users, chunks):
+                normalized.extend(part)
+    elapsed = time.perf_counter() - started
+    stats = {
+        "input": total,
+        "output": len(normalized),
+        "rejected": total - len(normalized),
+        "workers": workers,
+        "elapsed_seconds": round(elapsed, 3),
+        "records_per_second": round(total / elapsed, 1) if elapsed > 0 else None
+    }
+    return normalized, stats
+
 # Pergunta 8: Deep Key Map
 def deep_key_map(obj, key_fn, max_depth=float('inf'), current_depth=0):
     if current_depth >= max_depth:
@@ -115,104 +838,450 @@ def snake_to_camel(snake_str):
     components = snake_str.split('_')
     return components[0] + ''.join(x.title() for x in components[1:])
 
-def ensure_sales_orders_exists():
+# Payloads de API repetem as mesmas chaves: cache LRU limitado das conversões
+snake_to_camel_cached = lru_cache(maxsize=KEY_FN_CACHE_SIZE)(snake_to_camel)
+
+def deep_key_map_iter(obj, key_fn, max_depth=None, cache_size=KEY_FN_CACHE_SIZE):
+    """Mesmo resultado de deep_key_map, com pilha explícita (sem limite de recursão).
+
+    key_fn passa por um cache LRU de cache_size entradas (0 desliga). Subárvores
+    abaixo de max_depth e subárvores em que nenhuma chave muda são reaproveitadas
+    em vez de copiadas, então o resultado pode compartilhar objetos com a entrada.
+    """
+    if max_depth is None:
+        max_depth = float('inf')
+    if max_depth <= 0 or not isinstance(obj, (dict, list)):
+        return obj
+    if cache_size and not hasattr(key_fn, 'cache_info'):
+        key_fn = lru_cache(maxsize=cache_size)(key_fn)
+
+    # Frame: [origem, profundidade, iterador dos valores, chaves, valores novos, mudou?]
+    def new_frame(node, depth):
+        if isinstance(node, dict):
+            return [node, depth, iter(node.values()), list(node), [], False]
+        return [node, depth, iter(node), None, [], False]
+
+    stack = [new_frame(obj, 0)]
+    while True:
+        frame = stack[-1]
+        child_depth = frame[1] + 1
+        pushed = False
+        values = frame[4]
+        for child in frame[2]:
+            if child_depth < max_depth and isinstance(child, (dict, list)):
+                stack.append(new_frame(child, child_depth))
+                pushed = True
+                break
+            values.append(child)
+        if pushed:
+            continue
+
+        stack.pop()
+        node, _, _, keys, values, changed = frame
+        if keys is not None:
+            new_keys = [key_fn(k) for k in keys]
+            if not changed:
+                changed = any(nk != k or type(nk) is not type(k) for nk, k in zip(new_keys, keys))
+            built = dict(zip(new_keys, values)) if changed else node
+        else:
+            built = values if changed else node
+        if not stack:
+            return built
+        parent = stack[-1]
+        parent[4].append(built)
+        if built is not node:
+            parent[5] = True
+
+# Bootstrap do schema: migrations + seed executados uma vez por processo
+# Tabelas descritas com SQLAlchemy Core: o DDL é gerado conforme o dialeto
+# (AUTO_INCREMENT/ENGINE=InnoDB no MariaDB, INTEGER PRIMARY KEY no SQLite)
+schema_metadata = MetaData()
+MYSQL_TABLE_OPTS = {"mysql_engine": "InnoDB", "mysql_charset": "utf8mb4"}
+
+sales_orders_table = Table(
+    "Sales_Orders", schema_metadata,
+    Column("OrderID", Integer, primary_key=True, autoincrement=True),
+    Column("OrderDate", Date, nullable=False),
+    Column("Status", String(20), nullable=False),
+    Column("CustomerName", String(100), nullable=False),
+    Column("Amount", Numeric(10, 2), nullable=False),
+    Index("idx_status_orderdate", "Status", "OrderDate"),
+    **MYSQL_TABLE_OPTS
+)
+
+# Ordenação por data sem filtro de status (listagem do /demo/5 e exportação por período)
+sales_orders_date_index = Index("idx_orderdate_id", sales_orders_table.c.OrderDate, sales_orders_table.c.OrderID)
+
+relationships_table = Table(
+    "Relacionamentos", schema_metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("id_origem", Integer, nullable=False),
+    Column("id_destino", Integer, nullable=False),
+    Column("tipo_relacao", String(50), nullable=False),
+    Index("idx_rel_origem", "id_origem"),
+    Index("idx_rel_destino", "id_destino"),
+    **MYSQL_TABLE_OPTS
+)
+
+idempotency_keys_table = Table(
+    "Idempotency_Keys", schema_metadata,
+    Column("IdemKey", String(128), primary_key=True),
+    Column("Fingerprint", String(128), nullable=False),
+    Column("StatusCode", Integer, nullable=True),
+    Column("ResponseBody", Text, nullable=True),
+    Column("ExpiresAt", DateTime, nullable=False),
+    Index("idx_idem_expires", "ExpiresAt"),
+    **MYSQL_TABLE_OPTS
+)
+
+# Uma linha por (origem, tipo, destino) alcançável em até CLOSURE_MAX_DEPTH saltos.
+# tipo_relacao = '*' considera caminhos com qualquer tipo; os demais só caminhos daquele tipo.
+relationships_closure_table = Table(
+    "Relacionamentos_Closure", schema_metadata,
+    Column("id_origem", Integer, primary_key=True, autoincrement=False),
+    Column("tipo_relacao", String(50), primary_key=True),
+    Column("id_destino", Integer, primary_key=True, autoincrement=False),
+    Column("min_depth", Integer, nullable=False),
+    Index("idx_closure_depth", "id_origem", "tipo_relacao", "min_depth"),
+    Index("idx_closure_destino", "id_destino", "tipo_relacao"),
+    **MYSQL_TABLE_OPTS
+)
+
+# Grau de cada usuário mantido nas escritas de Relacionamentos (resumo e ranking sem GROUP BY)
+relationships_degree_table = Table(
+    "Relacionamentos_Degree", schema_metadata,
+    Column("usuario", Integer, primary_key=True, autoincrement=False),
+    Column("saidas", Integer, nullable=False),
+    Column("entradas", Integer, nullable=False),
+    Column("total_conexoes", Integer, nullable=False),
+    Index("idx_degree_total", "total_conexoes"),
+    Index("idx_degree_entradas", "entradas"),
+    Index("idx_degree_saidas", "saidas"),
+    **MYSQL_TABLE_OPTS
+)
+
+# Agregado diário de Sales_Orders por (data, status), mantido a cada escrita;
+# as consultas de analytics leem daqui em vez de varrer a tabela base
+sales_orders_daily_table = Table(
+    "Sales_Orders_Daily", schema_metadata,
+    Column("OrderDate", Date, primary_key=True),
+    Column("Status", String(20), primary_key=True),
+    Column("OrderCount", Integer, nullable=False),
+    Column("TotalAmount", Numeric(16, 2), nullable=False),
+    **MYSQL_TABLE_OPTS
+)
+
+# Mudanças de status agregadas pelo dia (UTC) em que aconteceram. É um log:
+# não dá para reconstruir a partir de Sales_Orders, então o rebuild não mexe aqui
+sales_orders_transitions_table = Table(
+    "Sales_Orders_Transitions", schema_metadata,
+    Column("TransitionDate", Date, primary_key=True),
+    Column("FromStatus", String(20), primary_key=True),
+    Column("ToStatus", String(20), primary_key=True),
+    Column("OrderCount", Integer, nullable=False),
+    Column("TotalAmount", Numeric(16, 2), nullable=False),
+    **MYSQL_TABLE_OPTS
+)
+
+# Uma linha por lock nomeado; o UPDATE da linha serializa escritas entre workers
+app_locks_table = Table(
+    "App_Locks", schema_metadata,
+    Column("Name", String(64), primary_key=True),
+    **MYSQL_TABLE_OPTS
+)
+
+schema_migrations_table = Table(
+    "Schema_Migrations", schema_metadata,
+    Column("Version", String(50), primary_key=True),
+    Column("AppliedAt", DateTime, nullable=False),
+    **MYSQL_TABLE_OPTS
+)
+
+def migrate_sales_orders(conn):
+    sales_orders_table.create(conn, checkfirst=True)
+
+def migrate_relationships(conn):
+    relationships_table.create(conn, checkfirst=True)
+
+def migrate_idempotency_keys(conn):
+    idempotency_keys_table.create(conn, checkfirst=True)
+
+def migrate_relationships_closure(conn):
+    relationships_closure_table.create(conn, checkfirst=True)
+
+def migrate_relationships_degree(conn):
+    relationships_degree_table.create(conn, checkfirst=True)
+    rebuild_degrees(conn)
+
+def migrate_sales_orders_date_index(conn):
+    sales_orders_date_index.create(conn, checkfirst=True)
+
+def migrate_sales_orders_rollups(conn):
+    sales_orders_daily_table.create(conn, checkfirst=True)
+    sales_orders_transitions_table.create(conn, checkfirst=True)
+    rebuild_order_rollups(conn)
+
+def migrate_app_locks(conn):
+    app_locks_table.create(conn, checkfirst=True)
+    conn.execute(text(sql_insert_ignore("App_Locks", ["Name"])), {"Name": CLOSURE_LOCK_NAME})
+
+# Ordem de aplicação; novas versões entram sempre no final
+MIGRATIONS = [
+    ("001_sales_orders", migrate_sales_orders),
+    ("002_relacionamentos", migrate_relationships),
+    ("003_idempotency_keys", migrate_idempotency_keys),
+    ("004_relacionamentos_closure", migrate_relationships_closure),
+    ("005_relacionamentos_degree", migrate_relationships_degree),
+    ("006_sales_orders_date_index", migrate_sales_orders_date_index),
+    ("007_sales_orders_rollups", migrate_sales_orders_rollups),
+    ("008_app_locks", migrate_app_locks),
+]
+
+def table_has_rows(conn, table):
+    # Sonda barata: para na primeira linha em vez de contar a tabela inteira
+    return bool(conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM {table})")).scalar())
+
+def seed_sales_orders(conn):
+    if table_has_rows(conn, "Sales_Orders"):
+        return False
+    from datetime import date, timedelta
+    today = date.today()
+    rows = [
+        {"OrderDate": (today - timedelta(days=10)).isoformat(), "Status": "PENDING", "CustomerName": "Alice", "Amount": 150.00},
+        {"OrderDate": (today - timedelta(days=9)).isoformat(),  "Status": "PENDING", "CustomerName": "Bruno", "Amount": 200.50},
+        {"OrderDate": (today - timedelta(days=8)).isoformat(),  "Status": "PROCESSED", "CustomerName": "Carla", "Amount": 75.25},
+        {"OrderDate": (today - timedelta(days=7)).isoformat(),  "Status": "PENDING", "CustomerName": "Diego", "Amount": 1200.00},
+        {"OrderDate": (today - timedelta(days=6)).isoformat(),  "Status": "PENDING", "CustomerName": "Eva", "Amount": 30.00},
+        {"OrderDate": (today - timedelta(days=5)).isoformat(),  "Status": "PROCESSED", "CustomerName": "Fábio", "Amount": 48.90},
+        {"OrderDate": (today - timedelta(days=4)).isoformat(),  "Status": "PENDING", "CustomerName": "Gisele", "Amount": 320.00},
+        {"OrderDate": (today - timedelta(days=3)).isoformat(),  "Status": "PENDING", "CustomerName": "Heitor", "Amount": 89.99},
+        {"OrderDate": (today - timedelta(days=2)).isoformat(),  "Status": "PROCESSED", "CustomerName": "Irene", "Amount": 10.00},
+        {"OrderDate": (today - timedelta(days=1)).isoformat(),  "Status": "PENDING", "CustomerName": "João", "Amount": 999.99},
+    ]
+    conn.execute(text("""
+        INSERT INTO Sales_Orders (OrderDate, Status, CustomerName, Amount)
+        VALUES (:OrderDate, :Status, :CustomerName, :Amount)
+    """), rows)
+    apply_order_rollup(conn, order_rollup_deltas(
+        (row["OrderDate"], row["Status"], 1, row["Amount"]) for row in rows
+    ))
+    return True
+
+def seed_relationships(conn):
+    if table_has_rows(conn, "Relacionamentos"):
+        return False
+    rows = [
+        {"id_origem": 1, "id_destino": 2, "tipo_relacao": "amigo"},
+        {"id_origem": 2, "id_destino": 3, "tipo_relacao": "amigo"},
+        {"id_origem": 3, "id_destino": 4, "tipo_relacao": "amigo"},
+        {"id_origem": 1, "id_destino": 5, "tipo_relacao": "seguidor"},
+        {"id_origem": 5, "id_destino": 6, "tipo_relacao": "seguidor"},
+        {"id_origem": 2, "id_destino": 5, "tipo_relacao": "colega"},
+        {"id_origem": 4, "id_destino": 6, "tipo_relacao": "colega"},
+        {"id_origem": 6, "id_destino": 7, "tipo_relacao": "amigo"},
+        {"id_origem": 3, "id_destino": 7, "tipo_relacao": "seguidor"},
+        {"id_origem": 7, "id_destino": 8, "tipo_relacao": "amigo"}
+    ]
+    conn.execute(text("""
+        INSERT INTO Relacionamentos (id_origem, id_destino, tipo_relacao)
+        VALUES (:id_origem, :id_destino, :tipo_relacao)
+    """), rows)
+    apply_degree_deltas(conn, rows)
+    return True
+
+# Um processo por vez aplica migrations e sementes (todos os workers do gunicorn
+# fazem o bootstrap ao subir)
+SCHEMA_LOCK_NAME = "msf_schema_migrations"
+SCHEMA_LOCK_TIMEOUT = int(os.getenv("SCHEMA_LOCK_TIMEOUT", "120"))
+
+@contextmanager
+def schema_migration_lock():
+    """Conexão que segura o lock de migrations entre processos.
+
+    SQLite: BEGIN IMMEDIATE pega o lock de escrita do banco e tudo roda numa
+    transação só (DDL do SQLite é transacional), confirmada na saída.
+    MariaDB/MySQL: GET_LOCK nomeado na sessão, liberado na saída.
+    """
+    with engine.connect() as conn:
+        if is_sqlite():
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+            yield conn
+            conn.commit()
+            return
+        got = conn.execute(text("SELECT GET_LOCK(:name, :timeout)"),
+                           {"name": SCHEMA_LOCK_NAME, "timeout": SCHEMA_LOCK_TIMEOUT}).scalar()
+        if got != 1:
+            raise RuntimeError(f"Lock de migrations não obtido em {SCHEMA_LOCK_TIMEOUT}s")
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": SCHEMA_LOCK_NAME})
+
+def run_migrations(conn):
+    """Aplica as versões pendentes na conexão de schema_migration_lock().
+
+    Os passos usam checkfirst/INSERT sem conflito, então repetir um passo já
+    aplicado (ou aplicado pela metade) não falha.
+    """
+    applied_now = []
+    schema_migrations_table.create(conn, checkfirst=True)
+    applied = {row[0] for row in conn.execute(text("SELECT Version FROM Schema_Migrations"))}
+    for version, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        migrate(conn)
+        conn.execute(text(sql_insert_ignore("Schema_Migrations", ["Version", "AppliedAt"])),
+                     {"Version": version, "AppliedAt": datetime.now(timezone.utc).replace(tzinfo=None)})
+        if not is_sqlite():
+            conn.commit()  # MariaDB: o DDL já fez commit implícito; grava a versão com os dados do passo
+        applied_now.append(version)
+    return applied_now
+
+schema_state = {"ready": False, "error": None, "checked_at": 0.0, "db_version": None,
+                "migrations_applied": [], "sales_orders": None, "relationships": None}
+schema_lock = threading.Lock()
+
+def bootstrap_schema():
+    """Aplica migrations e semeia tabelas vazias; o resultado fica em schema_state."""
     if not engine:
-        return {"created": False, "seeded": False}
-    created = False
-    seeded = False
-    try:
-        # Usa transação explícita para garantir commits
-        with engine.begin() as conn:
-            conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS Sales_Orders (
-                    OrderID INT AUTO_INCREMENT PRIMARY KEY,
-                    OrderDate DATE NOT NULL,
-                    Status VARCHAR(20) NOT NULL,
-                    CustomerName VARCHAR(100) NOT NULL,
-                    Amount DECIMAL(10,2) NOT NULL,
-                    INDEX idx_status_orderdate (Status, OrderDate)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
-            """))
-            # Detecta se a tabela estava vazia
-            cnt = conn.execute(text("SELECT COUNT(*) FROM Sales_Orders")).scalar()
-            if cnt == 0:
-                from datetime import date, timedelta
-                today = date.today()
-                rows = [
-                    {"OrderDate": (today - timedelta(days=10)).isoformat(), "Status": "PENDING", "CustomerName": "Alice", "Amount": 150.00},
-                    {"OrderDate": (today - timedelta(days=9)).isoformat(),  "Status": "PENDING", "CustomerName": "Bruno", "Amount": 200.50},
-                    {"OrderDate": (today - timedelta(days=8)).isoformat(),  "Status": "PROCESSED", "CustomerName": "Carla", "Amount": 75.25},
-                    {"OrderDate": (today - timedelta(days=7)).isoformat(),  "Status": "PENDING", "CustomerName": "Diego", "Amount": 1200.00},
-                    {"OrderDate": (today - timedelta(days=6)).isoformat(),  "Status": "PENDING", "CustomerName": "Eva", "Amount": 30.00},
-                    {"OrderDate": (today - timedelta(days=5)).isoformat(),  "Status": "PROCESSED", "CustomerName": "Fábio", "Amount": 48.90},
-                    {"OrderDate": (today - timedelta(days=4)).isoformat(),  "Status": "PENDING", "CustomerName": "Gisele", "Amount": 320.00},
-                    {"OrderDate": (today - timedelta(days=3)).isoformat(),  "Status": "PENDING", "CustomerName": "Heitor", "Amount": 89.99},
-                    {"OrderDate": (today - timedelta(days=2)).isoformat(),  "Status": "PROCESSED", "CustomerName": "Irene", "Amount": 10.00},
-                    {"OrderDate": (today - timedelta(days=1)).isoformat(),  "Status": "PENDING", "CustomerName": "João", "Amount": 999.99},
-                ]
-                conn.execute(text("""
-                    INSERT INTO Sales_Orders (OrderDate, Status, CustomerName, Amount)
-                    VALUES (:OrderDate, :Status, :CustomerName, :Amount)
-                """), rows)
-                seeded = True
-        # Se chegamos aqui sem erro, a tabela existe
-        created = True
-    except Exception as e:
-        print(f"Erro ao criar/semear Sales_Orders: {e}")
-    return {"created": created, "seeded": seeded}
+        return schema_state
+    with schema_lock:
+        schema_state['checked_at'] = time.monotonic()
+        try:
+            with engine.connect() as conn:
+                schema_state['db_version'] = server_version(conn)
+            with schema_migration_lock() as conn:
+                schema_state['migrations_applied'] = run_migrations(conn)
+                schema_state['sales_orders'] = {"created": True, "seeded": seed_sales_orders(conn)}
+                schema_state['relationships'] = {"created": True, "seeded": seed_relationships(conn)}
+                if CLOSURE_ENABLED and schema_state['relationships']['seeded']:
+                    rebuild_closure(conn)
+            schema_state.update(ready=True, error=None)
+        except Exception as e:
+            print(f"Erro no bootstrap do schema: {e}")
+            schema_state.update(ready=False, error=str(e))
+    return schema_state
+
+def ensure_schema_ready():
+    # Rotas chamam isto a cada requisição: após o primeiro sucesso é só uma leitura
+    # de flag; em caso de falha, nova tentativa no máximo a cada 30s.
+    if not schema_state['ready'] and time.monotonic() - schema_state['checked_at'] >= 30:
+        bootstrap_schema()
+    return schema_state
+
+def ensure_sales_orders_exists():
+    state = ensure_schema_ready()
+    return state['sales_orders'] or {"created": False, "seeded": False}
 
 def ensure_relationships_exists():
-    if not engine:
-        return {"created": False, "seeded": False}
-    created = False
-    seeded = False
-    try:
-        with engine.begin() as conn:
-            conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS Relacionamentos (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    id_origem INT NOT NULL,
-                    id_destino INT NOT NULL,
-                    tipo_relacao VARCHAR(50) NOT NULL,
-                    INDEX idx_rel_origem (id_origem),
-                    INDEX idx_rel_destino (id_destino)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
-            """))
-            cnt = conn.execute(text("SELECT COUNT(*) FROM Relacionamentos")).scalar()
-            if cnt == 0:
-                rows = [
-                    {"id_origem": 1, "id_destino": 2, "tipo_relacao": "amigo"},
-                    {"id_origem": 2, "id_destino": 3, "tipo_relacao": "amigo"},
-                    {"id_origem": 3, "id_destino": 4, "tipo_relacao": "amigo"},
-                    {"id_origem": 1, "id_destino": 5, "tipo_relacao": "seguidor"},
-                    {"id_origem": 5, "id_destino": 6, "tipo_relacao": "seguidor"},
-                    {"id_origem": 2, "id_destino": 5, "tipo_relacao": "colega"},
-                    {"id_origem": 4, "id_destino": 6, "tipo_relacao": "colega"},
-                    {"id_origem": 6, "id_destino": 7, "tipo_relacao": "amigo"},
-                    {"id_origem": 3, "id_destino": 7, "tipo_relacao": "seguidor"},
-                    {"id_origem": 7, "id_destino": 8, "tipo_relacao": "amigo"}
-                ]
-                conn.execute(text("""
-                    INSERT INTO Relacionamentos (id_origem, id_destino, tipo_relacao)
-                    VALUES (:id_origem, :id_destino, :tipo_relacao)
-                """), rows)
-                seeded = True
-        created = True
-    except Exception as e:
-        print(f"Erro ao criar/semear Relacionamentos: {e}")
-    return {"created": created, "seeded": seeded}
+    state = ensure_schema_ready()
+    return state['relationships'] or {"created": False, "seeded": False}
+
+class AssetCache:
+    """Arquivos servidos direto da memória, com variantes comprimidas pré-calculadas.
+
+    O arquivo é relido só quando o mtime (ou o tamanho) muda, e o stat() é feito
+    no máximo a cada check_interval segundos: visitas repetidas não tocam o disco.
+    """
+
+    COMPRESSIBLE = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+
+    def __init__(self, check_interval=2.0, max_age=60):
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _load(self, path, mimetype, stat):
+        with open(path, 'rb') as f:
+            body = f.read()
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        variants = {None: (body, digest)}
+        if mimetype.startswith(self.COMPRESSIBLE):
+            gz = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(gz) < len(body):
+                variants['gzip'] = (gz, f"{digest}-gz")
+            if brotli is not None:
+                br = brotli.compress(body, quality=11)
+                if len(br) < len(body):
+                    variants['br'] = (br, f"{digest}-br")
+        return {
+            "variants": variants,
+            "mimetype": mimetype,
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "last_modified": datetime.fromtimestamp(int(stat.st_mtime), timezone.utc),
+            "checked_at": time.monotonic()
+        }
+
+    def get(self, path, mimetype):
+        entry = self._entries.get(path)
+        now = time.monotonic()
+        if entry is not None and now - entry["checked_at"] < self.check_interval:
+            return entry
+        stat = os.stat(path)
+        if entry is not None and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            entry["checked_at"] = now
+            return entry
+        with self._lock:
+            entry = self._load(path, mimetype, stat)
+            self._entries[path] = entry
+        return entry
+
+    def serve(self, path, mimetype):
+        entry = self.get(path, mimetype)
+        variants = entry["variants"]
+        encoding = None
+        for candidate in ('br', 'gzip'):
+            if candidate in variants and request.accept_encodings[candidate] > 0:
+                encoding = candidate
+                break
+        body, etag = variants[encoding]
+
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(etag)
+        else:
+            since = request.if_modified_since
+            not_modified = since is not None and since >= entry["last_modified"]
+
+        response = Response(b'' if not_modified else body, status=304 if not_modified else 200,
+                            mimetype=entry["mimetype"])
+        response.set_etag(etag)
+        response.last_modified = entry["last_modified"]
+        response.cache_control.public = True
+        response.cache_control.max_age = self.max_age
+        if len(variants) > 1:
+            response.vary.add('Accept-Encoding')
+        if encoding and not not_modified:
+            response.headers['Content-Encoding'] = encoding
+        return response
+
+asset_cache = AssetCache(check_interval=ASSET_CHECK_INTERVAL, max_age=ASSET_MAX_AGE)
 
 @app.route('/static/p1-oauth.png')
 def p1_oauth_image():
     image_path = os.path.join(app.root_path, 'image.png')
-    return send_file(image_path, mimetype='image/png')
+    return asset_cache.serve(image_path, 'image/png')
 
-def get_sales_orders():
+def get_sales_orders_page(status=None, cursor=None, per_page=DEMO_ORDERS_PAGE_SIZE):
+    """Página de Sales_Orders do mais recente para o mais antigo (keyset, sem OFFSET nem COUNT)."""
+    empty = {"data": [], "next_cursor": None}
     if not engine:
-        return []
+        return empty
+    conditions = []
+    params = {"limit": per_page + 1}
+    if status:
+        conditions.append("Status = :status")
+        params["status"] = status
+    if cursor:
+        last_date, last_id = decode_cursor(cursor)
+        conditions.append("OrderDate <= :last_date AND (OrderDate < :last_date OR OrderID < :last_id)")
+        params.update(last_date=last_date, last_id=last_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
     try:
         with engine.connect() as conn:
-            result = conn.execute(text("""
+            result = conn.execute(text(f"""
                 SELECT 
                     OrderID,
                     OrderDate,
@@ -220,85 +1289,823 @@ def get_sales_orders():
                     CustomerName,
                     Amount
                 FROM Sales_Orders
+                {where}
                 ORDER BY OrderDate DESC, OrderID DESC
-            """))
-            return [dict(row) for row in result.mappings()]
+                LIMIT :limit
+            """), params)
+            data = [dict(row) for row in result.mappings()]
     except Exception as e:
         print(f"Erro ao carregar Sales_Orders: {e}")
-        return []
+        return empty
+    # Uma linha a mais indica se existe próxima página
+    next_cursor = None
+    if len(data) > per_page:
+        data = data[:per_page]
+        next_cursor = encode_cursor(data[-1]['OrderDate'], data[-1]['OrderID'])
+    return {"data": data, "next_cursor": next_cursor}
+
+EXPORT_COLUMNS = ["OrderID", "OrderDate", "Status", "CustomerName", "Amount"]
+
+def iter_sales_orders_export(status=None, date_from=None, date_to=None, yield_per=None):
+    """Gera lotes de linhas via cursor no servidor: memória constante, sem carregar a tabela."""
+    conditions = []
+    params = {}
+    if status:
+        conditions.append("Status = :status")
+        params["status"] = status
+    if date_from:
+        conditions.append("OrderDate >= :date_from")
+        params["date_from"] = date_from
+    if date_to:
+        conditions.append("OrderDate <= :date_to")
+        params["date_to"] = date_to
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    # Com filtro, a ordem segue um índice (Status, OrderDate) ou (OrderDate, OrderID);
+    # sem filtro, a PK: nos dois casos o banco devolve a primeira linha sem ordenar tudo
+    order_by = "OrderDate, OrderID" if conditions else "OrderID"
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=yield_per or EXPORT_YIELD_PER).execute(text(f"""
+            SELECT {', '.join(EXPORT_COLUMNS)}
+            FROM Sales_Orders
+            {where}
+            ORDER BY {order_by}
+        """), params)
+        for partition in result.mappings().partitions():
+            yield partition
+
+def stream_sales_orders_csv(**filters):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    # Cabeçalho sai antes da consulta: o primeiro byte não depende do tamanho da tabela
+    yield buffer.getvalue()
+    for partition in iter_sales_orders_export(**filters):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([row[col] for col in EXPORT_COLUMNS] for row in partition)
+        yield buffer.getvalue()
+
+def stream_sales_orders_ndjson(**filters):
+    for partition in iter_sales_orders_export(**filters):
+        yield ''.join(json.dumps(dict(row), default=str) + '\n' for row in partition)
 
 # Pergunta 6: Mock API Logic
-def get_orders_page(status='PENDING', page=1, per_page=20):
+def encode_cursor(order_date, order_id):
+    # Cursor opaco: posição (OrderDate, OrderID) do último registro da página
+    if hasattr(order_date, 'isoformat'):
+        order_date = order_date.isoformat()
+    raw = json.dumps([str(order_date), int(order_id)], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        order_date, order_id = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        return str(order_date), int(order_id)
+    except Exception:
+        raise ValueError("Cursor inválido")
+
+class OrdersPageCache:
+    """Cache read-through (LRU + TTL) das páginas de pedidos.
+
+    Toda escrita em Sales_Orders chama bump(); uma entrada só é servida se foi
+    gravada na geração atual. A geração é lida antes da consulta, então um
+    resultado lido durante uma escrita nunca é servido depois dela. Escritas
+    de outros workers só são vistas quando o TTL expira.
+    """
+
+    def __init__(self, ttl=5.0, max_entries=256, enabled=True):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.generation = 0
+        self._entries = OrderedDict()  # key -> (generation, expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def bump(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def get(self, key, generation):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generation and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            return None
+
+    def put(self, key, generation, value):
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (generation, time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"enabled": self.enabled, "generation": self.generation, "entries": len(self._entries),
+                    "hits": self.hits, "misses": self.misses, "ttl_seconds": self.ttl}
+
+orders_cache = OrdersPageCache(ORDERS_CACHE_TTL_SECONDS, ORDERS_CACHE_MAX_ENTRIES, ORDERS_CACHE_ENABLED)
+
+def get_orders_page(status='PENDING', page=1, per_page=20, cursor=None, use_cache=False):
+    """Uma página de pedidos; use_cache=True passa pelo orders_cache (a drenagem lê sempre do banco)."""
     if not engine:
-        return {"data": [], "next_page": None}
+        return {"data": [], "next_page": None, "next_cursor": None}
+    if cursor:
+        # Keyset (seek): continua a partir da última posição vista, usando
+        # idx_status_orderdate (Status, OrderDate, PK implícita) sem varrer
+        # as linhas já lidas. O custo da página não depende da profundidade.
+        last_date, last_id = decode_cursor(cursor)
+        query = text("""
+            SELECT 
+                OrderID AS id,
+                Status AS status,
+                Amount,
+                OrderDate,
+                CustomerName
+            FROM Sales_Orders
+            WHERE Status = :status
+              AND OrderDate >= :last_date
+              AND (OrderDate > :last_date OR OrderID > :last_id)
+            ORDER BY OrderDate, OrderID
+            LIMIT :limit
+        """)
+        params = {"status": status, "last_date": last_date, "last_id": last_id, "limit": per_page}
+    else:
+        offset = (page - 1) * per_page
+        query = text("""
+            SELECT 
+                OrderID AS id,
+                Status AS status,
+                Amount,
+                OrderDate,
+                CustomerName
+            FROM Sales_Orders
+            WHERE Status = :status
+            ORDER BY OrderDate, OrderID
+            LIMIT :limit OFFSET :offset
+        """)
+        params = {"status": status, "limit": per_page, "offset": offset}
+    use_cache = use_cache and orders_cache.enabled
+    if use_cache:
+        cache_key = (status, ('cursor', cursor) if cursor else ('page', page), per_page)
+        generation = orders_cache.generation
+        cached = orders_cache.get(cache_key, generation)
+        if cached is not None:
+            return cached
     try:
         with engine.connect() as conn:
-            offset = (page - 1) * per_page
-            result = conn.execute(text("""
-                SELECT 
-                    OrderID AS id,
-                    Status AS status,
-                    Amount,
-                    OrderDate,
-                    CustomerName
-                FROM Sales_Orders
-                WHERE Status = :status
-                ORDER BY OrderDate, OrderID
-                LIMIT :limit OFFSET :offset
-            """), {"status": status, "limit": per_page, "offset": offset})
+            result = conn.execute(query, params)
             rows = list(result.mappings())
             data = [dict(row) for row in rows]
-            next_page = page + 1 if len(data) == per_page else None
-            return {"data": data, "next_page": next_page}
+            full_page = len(data) == per_page
+            next_page = page + 1 if full_page and not cursor else None
+            next_cursor = encode_cursor(data[-1]['OrderDate'], data[-1]['id']) if full_page else None
+            page_result = {"data": data, "next_page": next_page, "next_cursor": next_cursor}
+            if use_cache:
+                orders_cache.put(cache_key, generation, page_result)
+            return page_result
     except Exception as e:
         print(f"Erro ao buscar pedidos da API mock: {e}")
-        return {"data": [], "next_page": None}
+        return {"data": [], "next_page": None, "next_cursor": None}
+
+def mock_api_get_pending(page=1, per_page=20, cursor=None):
+    return get_orders_page('PENDING', page=page, per_page=per_page, cursor=cursor)
+
+# Sessão HTTP compartilhada: conexões keep-alive reaproveitadas entre chamadas e threads
+confirm_http_lock = threading.Lock()
+confirm_http_state = {"pid": None, "session": None}
+
+def get_confirm_session():
+    # Uma sessão por processo (workers do gunicorn não herdam sockets do master)
+    if confirm_http_state["pid"] == os.getpid():
+        return confirm_http_state["session"]
+    with confirm_http_lock:
+        if confirm_http_state["pid"] != os.getpid():
+            session_ = requests.Session()
+            # pool_block: acima de pool_size as threads esperam uma conexão livre
+            # em vez de abrir conexões descartáveis; retries ficam no confirm_with_retry
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=CONFIRM_HTTP_POOL_SIZE,
+                                                    pool_block=True, max_retries=0)
+            session_.mount("http://", adapter)
+            session_.mount("https://", adapter)
+            session_.headers.update({"Authorization": f"Bearer {API_TOKEN}", "Accept": "application/json"})
+            confirm_http_state.update(pid=os.getpid(), session=session_)
+    return confirm_http_state["session"]
+
+def confirm_order_http(order_id, idempotency_key):
+    started = time.perf_counter()
+    try:
+        response = get_confirm_session().post(
+            f"{MOCK_API_BASE_URL}/orders/{order_id}/confirm",
+            headers={"Idempotency-Key": idempotency_key},
+            timeout=(CONFIRM_HTTP_CONNECT_TIMEOUT, CONFIRM_HTTP_READ_TIMEOUT)
+        )
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        metrics.inc("confirm_http_requests_total", outcome=type(e).__name__)
+        raise
+    finally:
+        metrics.inc("confirm_http_seconds_total", time.perf_counter() - started)
+    metrics.inc("confirm_http_requests_total", outcome="ok")
+    return response.json()
+
+# Rollup diário de Sales_Orders: toda mudança de status ou inserção aplica deltas
+# em Sales_Orders_Daily na mesma transação da escrita
+def order_rollup_deltas(rows, sign=1, into=None):
+    """Soma linhas (OrderDate, Status, quantidade, valor) em {(data, status): [qtd, valor]}."""
+    deltas = {} if into is None else into
+    for order_date, status, count, amount in rows:
+        entry = deltas.setdefault((str(order_date), status), [0, Decimal(0)])
+        entry[0] += sign * count
+        entry[1] += sign * Decimal(str(amount or 0))
+    return deltas
+
+def rollup_amount(value):
+    # O driver sqlite3 não aceita Decimal como parâmetro
+    return float(value) if is_sqlite() else value
+
+def apply_order_rollup(conn, deltas):
+    rows = [
+        {"OrderDate": order_date, "Status": status, "OrderCount": count, "TotalAmount": rollup_amount(amount)}
+        for (order_date, status), (count, amount) in deltas.items() if count
+    ]
+    if not rows:
+        return
+    conn.execute(text(sql_upsert_add("Sales_Orders_Daily", ["OrderDate", "Status"], ["OrderCount", "TotalAmount"])), rows)
+    emptied = [{"OrderDate": row["OrderDate"], "Status": row["Status"]} for row in rows if row["OrderCount"] < 0]
+    if emptied:
+        conn.execute(text("""
+            DELETE FROM Sales_Orders_Daily
+            WHERE OrderDate = :OrderDate AND Status = :Status AND OrderCount <= 0
+        """), emptied)
+
+def apply_status_change_rollup(conn, groups, new_status):
+    """Aplica uma mudança de status ao rollup e registra a transição.
 
-def mock_api_get_pending(page=1, per_page=20):
-    return get_orders_page('PENDING', page=page, per_page=per_page)
+    groups: linhas (OrderDate, Status antigo, quantidade, valor) das linhas que
+    mudaram para new_status.
+    """
+    groups = [g for g in groups if g[1] != new_status]
+    if not groups:
+        return
+    deltas = order_rollup_deltas(groups, sign=-1)
+    order_rollup_deltas(((g[0], new_status, g[2], g[3]) for g in groups), into=deltas)
+    apply_order_rollup(conn, deltas)
+    transitions = {}
+    for _, old_status, count, amount in groups:
+        entry = transitions.setdefault(old_status, [0, Decimal(0)])
+        entry[0] += count
+        entry[1] += Decimal(str(amount or 0))
+    today = datetime.now(timezone.utc).date().isoformat()
+    conn.execute(text(sql_upsert_add("Sales_Orders_Transitions", ["TransitionDate", "FromStatus", "ToStatus"],
+                                     ["OrderCount", "TotalAmount"])), [
+        {"TransitionDate": today, "FromStatus": old_status, "ToStatus": new_status,
+         "OrderCount": count, "TotalAmount": rollup_amount(amount)}
+        for old_status, (count, amount) in transitions.items()
+    ])
+
+def take_sqlite_write_lock(conn):
+    # SQLite não tem SELECT ... FOR UPDATE: pega o lock de escrita antes do SELECT.
+    # Ler e depois escrever na mesma transação falha com "database is locked" se
+    # outro escritor commitar no meio, e duas transações leriam as mesmas linhas
+    if is_sqlite():
+        conn.execute(text("UPDATE Sales_Orders_Daily SET OrderCount = OrderCount WHERE 1 = 0"))
+
+def update_order_status(conn, new_status, where_clause, params=None):
+    """UPDATE Sales_Orders SET Status = new_status WHERE <where_clause>, mantendo o rollup.
+
+    Agrega (com lock de linha) o que vai mudar antes do UPDATE, na mesma
+    transação, então os deltas batem com as linhas realmente alteradas.
+    where_clause é trecho fixo do código e deve excluir linhas já em new_status.
+    """
+    params = dict(params or {})
+    take_sqlite_write_lock(conn)
+    groups = conn.execute(text(f"""
+        SELECT OrderDate, Status, COUNT(*), SUM(Amount)
+        FROM Sales_Orders
+        WHERE {where_clause}
+        GROUP BY OrderDate, Status
+        {sql_for_update()}
+    """), params).all()
+    if not groups:
+        return 0
+    result = conn.execute(text(f"UPDATE Sales_Orders SET Status = :new_status WHERE {where_clause}"),
+                          {**params, "new_status": new_status})
+    apply_status_change_rollup(conn, groups, new_status)
+    return result.rowcount
+
+def rebuild_order_rollups(conn):
+    # Recalcula só Sales_Orders_Daily; Sales_Orders_Transitions é histórico
+    conn.execute(text("DELETE FROM Sales_Orders_Daily"))
+    conn.execute(text("""
+        INSERT INTO Sales_Orders_Daily (OrderDate, Status, OrderCount, TotalAmount)
+        SELECT OrderDate, Status, COUNT(*), SUM(Amount)
+        FROM Sales_Orders
+        GROUP BY OrderDate, Status
+    """))
+    return conn.execute(text("SELECT COUNT(*) FROM Sales_Orders_Daily")).scalar()
+
+def rollup_number(value):
+    return round(float(value or 0), 2)
+
+def get_order_analytics(date_from, date_to, status=None):
+    """Totais por dia, acumulados e transições de status lidos só dos rollups.
+
+    Dias sem pedidos não aparecem. Os acumulados contam desde o início do
+    histórico (a janela roda sobre todos os dias até date_to, e o filtro de
+    date_from vem depois), com o status aplicado quando informado.
+    """
+    params = {"date_from": date_from.isoformat(), "date_to": date_to.isoformat(), "status": status}
+    status_filter = "AND Status = :status" if status else ""
+    with engine.connect() as conn:
+        days = conn.execute(text(f"""
+            SELECT OrderDate, orders, amount, running_orders, running_amount
+            FROM (
+                SELECT OrderDate,
+                       SUM(OrderCount) AS orders,
+                       SUM(TotalAmount) AS amount,
+                       SUM(SUM(OrderCount)) OVER (ORDER BY OrderDate) AS running_orders,
+                       SUM(SUM(TotalAmount)) OVER (ORDER BY OrderDate) AS running_amount
+                FROM Sales_Orders_Daily
+                WHERE OrderDate <= :date_to {status_filter}
+                GROUP BY OrderDate
+            ) AS daily
+            WHERE OrderDate >= :date_from
+            ORDER BY OrderDate
+        """), params).all()
+        by_status = conn.execute(text(f"""
+            SELECT OrderDate, Status, OrderCount, TotalAmount
+            FROM Sales_Orders_Daily
+            WHERE OrderDate >= :date_from AND OrderDate <= :date_to {status_filter}
+        """), params).all()
+        transitions = conn.execute(text(f"""
+            SELECT TransitionDate, FromStatus, ToStatus, OrderCount, TotalAmount
+            FROM Sales_Orders_Transitions
+            WHERE TransitionDate >= :date_from AND TransitionDate <= :date_to
+            {"AND (FromStatus = :status OR ToStatus = :status)" if status else ""}
+            ORDER BY TransitionDate, FromStatus, ToStatus
+        """), params).all()
+
+    statuses_by_day = {}
+    totals_by_status = {}
+    for order_date, row_status, count, amount in by_status:
+        statuses_by_day.setdefault(str(order_date), {})[row_status] = {
+            "orders": int(count), "amount": rollup_number(amount)
+        }
+        total = totals_by_status.setdefault(row_status, {"orders": 0, "amount": 0.0})
+        total["orders"] += int(count)
+        total["amount"] = rollup_number(total["amount"] + float(amount or 0))
+    return {
+        "from": params["date_from"],
+        "to": params["date_to"],
+        "status": status,
+        "days": [
+            {
+                "date": str(order_date),
+                "orders": int(orders),
+                "amount": rollup_number(amount),
+                "running_orders": int(running_orders),
+                "running_amount": rollup_number(running_amount),
+                "by_status": statuses_by_day.get(str(order_date), {})
+            }
+            for order_date, orders, amount, running_orders, running_amount in days
+        ],
+        "totals": {
+            "orders": sum(t["orders"] for t in totals_by_status.values()),
+            "amount": rollup_number(sum(t["amount"] for t in totals_by_status.values())),
+            "by_status": totals_by_status
+        },
+        "transitions": [
+            {"date": str(day), "from": from_status, "to": to_status,
+             "orders": int(count), "amount": rollup_number(amount)}
+            for day, from_status, to_status, count, amount in transitions
+        ]
+    }
 
 def mock_api_confirm(order_id, idempotency_key):
-    import random
-    if random.random() < 0.2:
-        raise requests.exceptions.HTTPError("500 Server Error")
+    if CONFIRM_CLIENT_MODE == 'http':
+        # Erros HTTP/timeout sobem como RequestException e entram no retry do chamador
+        confirm_order_http(order_id, idempotency_key)
+    else:
+        if random.random() < CONFIRM_LOCAL_FAILURE_RATE:
+            raise requests.exceptions.HTTPError("500 Server Error")
     if not engine:
         return {"status": "confirmed", "order_id": order_id}
     try:
         with engine.begin() as conn:
-            conn.execute(text("""
-                UPDATE Sales_Orders
-                SET Status = 'PROCESSED'
-                WHERE OrderID = :order_id AND Status = 'PENDING'
-            """), {"order_id": order_id})
+            update_order_status(conn, 'PROCESSED', "OrderID = :order_id AND Status = 'PENDING'",
+                                {"order_id": order_id})
+        orders_cache.bump()
         return {"status": "confirmed", "order_id": order_id}
     except Exception as e:
         raise requests.exceptions.HTTPError(str(e))
 
-# -------------------------------------------------------------------
-# Rotas
-# -------------------------------------------------------------------
+def confirm_orders_batch(order_ids, chunk_size=None):
+    """Confirma vários pedidos com UPDATEs em conjunto, um commit por lote.
 
-@app.route('/')
-def index():
-    return render_template('index.html')
+    Retorna um resultado por ID (duplicados contam uma vez) indicando se a
+    linha realmente saiu de PENDING nesta chamada. Repetir o lote é seguro:
+    só linhas ainda PENDING mudam, as demais voltam como already_processed.
+    """
+    chunk_size = chunk_size or CONFIRM_BATCH_CHUNK_SIZE
+    order_ids = list(dict.fromkeys(order_ids))
+    results = {}
+    chunks = 0
+    for i in range(0, len(order_ids), chunk_size):
+        chunk = order_ids[i:i + chunk_size]
+        chunks += 1
+        if not engine:
+            results.update({oid: "error" for oid in chunk})
+            continue
+        try:
+            with engine.begin() as conn:
+                # Trava as linhas do lote para saber exatamente quais mudam
+                take_sqlite_write_lock(conn)
+                found = conn.execute(
+                    text(f"""
+                        SELECT OrderID, Status, OrderDate, Amount
+                        FROM Sales_Orders
+                        WHERE OrderID IN :ids
+                        {sql_for_update()}
+                    """).bindparams(bindparam("ids", expanding=True)),
+                    {"ids": chunk}
+                ).all()
+                statuses = {row[0]: row[1] for row in found}
+                pending = [oid for oid, st in statuses.items() if st == 'PENDING']
+                if pending:
+                    conn.execute(
+                        text("""
+                            UPDATE Sales_Orders
+                            SET Status = 'PROCESSED'
+                            WHERE OrderID IN :ids AND Status = 'PENDING'
+                        """).bindparams(bindparam("ids", expanding=True)),
+                        {"ids": pending}
+                    )
+                    apply_status_change_rollup(conn, [
+                        (row[2], row[1], 1, row[3]) for row in found if row[1] == 'PENDING'
+                    ], 'PROCESSED')
+            if pending:
+                orders_cache.bump()
+            for oid in chunk:
+                if oid not in statuses:
+                    results[oid] = "not_found"
+                elif statuses[oid] == 'PENDING':
+                    results[oid] = "confirmed"
+                else:
+                    results[oid] = "already_processed"
+        except Exception as e:
+            print(f"Erro ao confirmar lote de pedidos: {e}")
+            results.update({oid: "error" for oid in chunk})
+    return {
+        "results": [
+            {
+                "order_id": oid,
+                "status": results[oid],
+                "changed": results[oid] == "confirmed"
+            }
+            for oid in order_ids
+        ],
+        "chunks": chunks
+    }
 
-@app.route('/responses')
-def responses():
-    # Renderiza como HTML puro, ignorando sintaxe Jinja2 no conteúdo
-    with open('templates/responses.html', 'r', encoding='utf-8') as f:
-        content = f.read()
-    return content
+# Atualização em massa em lotes pela faixa de PK (não trava a tabela toda)
+def is_lock_conflict(exc):
+    code = getattr(getattr(exc, 'orig', None), 'args', [None])[0]
+    if isinstance(code, str):
+        return 'database is locked' in code  # SQLite
+    return code in (1205, 1213)  # lock wait timeout / deadlock (MariaDB/MySQL)
 
-@app.route('/responses/notion')
-def responses_notion():
-    try:
-        with open('Responses-notion.html', 'r', encoding='utf-8') as f:
-            return f.read()
-    except Exception as e:
-        return f"Erro ao carregar Notion export: {e}", 500
+def chunked_update(new_status, where_clause, params=None, batch_size=None, sleep_seconds=None,
+                   max_retries=5, progress=None):
+    """Executa UPDATE Sales_Orders SET Status = new_status WHERE <where_clause> em lotes.
 
-# Demo 1: OAuth Flow
-@app.route('/demo/1')
+    Percorre OrderID em faixas com um commit por faixa, assim cada transação
+    segura poucos locks. Cada faixa termina no batch_size-ésimo OrderID que
+    ainda casa com where_clause (busca por keyset), então IDs esparsos não
+    geram lotes vazios. Conflitos de lock (deadlock ou lock wait timeout)
+    repetem só a faixa atual. where_clause é trecho fixo do código; valores
+    do usuário vão em params. O rollup diário é atualizado junto com cada
+    faixa (update_order_status).
+    """
+    batch_size = batch_size or BULK_UPDATE_BATCH_SIZE
+    sleep_seconds = BULK_UPDATE_SLEEP_SECONDS if sleep_seconds is None else sleep_seconds
+    params = dict(params or {})
+    started = time.monotonic()
+    stats = {"affected": 0, "batches": 0, "retries": 0}
+    with engine.connect() as conn:
+        high = conn.execute(text("SELECT MAX(OrderID) FROM Sales_Orders")).scalar()
+    boundary_query = text(f"""
+        SELECT MAX(OrderID), COUNT(*)
+        FROM (
+            SELECT OrderID FROM Sales_Orders
+            WHERE OrderID > :after_id AND ({where_clause})
+            ORDER BY OrderID
+            LIMIT :batch_size
+        ) AS batch
+    """)
+    range_where = f"OrderID > :after_id AND OrderID <= :last_id AND ({where_clause})"
+    after_id = 0
+    while high is not None:
+        with engine.connect() as conn:
+            last_id, found = conn.execute(boundary_query, {**params, "after_id": after_id,
+                                                           "batch_size": batch_size}).first()
+        if not found:
+            break
+        attempt = 0
+        while True:
+            try:
+                with engine.begin() as conn:
+                    affected = update_order_status(conn, new_status, range_where,
+                                                   {**params, "after_id": after_id, "last_id": last_id})
+                orders_cache.bump()
+                stats["affected"] += affected
+                break
+            except OperationalError as e:
+                attempt += 1
+                if not is_lock_conflict(e) or attempt > max_retries:
+                    raise
+                stats["retries"] += 1
+                time.sleep(min(2.0, 0.05 * (2 ** attempt)) * random.uniform(0.5, 1.0))
+        stats["batches"] += 1
+        if progress:
+            progress({**stats, "after_id": after_id, "last_id": last_id, "max_id": high})
+        after_id = last_id
+        if found < batch_size:
+            break
+        if sleep_seconds:
+            time.sleep(sleep_seconds)
+    stats["elapsed_seconds"] = round(time.monotonic() - started, 3)
+    return stats
+
+def get_bulk_update_options(params):
+    mode = str(params.get('mode') or BULK_UPDATE_MODE).lower()
+    try:
+        batch_size = max(1, int(params.get('batch_size') or BULK_UPDATE_BATCH_SIZE))
+    except (TypeError, ValueError):
+        batch_size = BULK_UPDATE_BATCH_SIZE
+    try:
+        sleep_ms = params.get('sleep_ms')
+        sleep_seconds = max(0.0, float(sleep_ms) / 1000) if sleep_ms not in (None, '') else BULK_UPDATE_SLEEP_SECONDS
+    except (TypeError, ValueError):
+        sleep_seconds = BULK_UPDATE_SLEEP_SECONDS
+    return {"chunked": mode == 'chunked', "batch_size": batch_size, "sleep_seconds": sleep_seconds}
+
+def log_bulk_progress(info):
+    if info["batches"] % 50 == 0:
+        print(f"Atualização em lotes: {info['batches']} lotes, {info['affected']} linhas, "
+              f"OrderID até {info['last_id']}/{info['max_id']}")
+
+# Ledger de idempotência para POST /api/orders/<id>/confirm
+def ensure_idempotency_table():
+    if not engine:
+        return False
+    try:
+        with engine.begin() as conn:
+            migrate_idempotency_keys(conn)
+        return True
+    except Exception as e:
+        print(f"Erro ao criar Idempotency_Keys: {e}")
+        return False
+
+class IdempotencyStore:
+    """Guarda a resposta de cada Idempotency-Key por ttl segundos.
+
+    backend='memory' mantém até max_keys chaves no processo (LRU);
+    backend='table' usa a tabela Idempotency_Keys, compartilhada entre os
+    workers do gunicorn. Requisições simultâneas com a mesma chave são
+    colapsadas: só uma executa, as demais recebem a mesma resposta.
+    Apenas respostas 2xx ficam gravadas; erros liberam a chave para retry.
+    """
+
+    def __init__(self, backend='memory', ttl=86400, max_keys=10000, wait_timeout=10.0):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.wait_timeout = wait_timeout
+        self._entries = OrderedDict()  # key -> (expires_at, fingerprint, body, status)
+        self._in_flight = {}           # key -> threading.Event
+        self._lock = threading.Lock()
+        self._table_ready = False
+        self._table_checked_at = None
+        self._writes = 0
+
+    def execute(self, key, fingerprint, fn):
+        """Retorna (body, status, replayed); fn() -> (body, status)."""
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            with self._lock:
+                cached = self._get_local(key)
+                if cached is None:
+                    event = self._in_flight.get(key)
+                    if event is None:
+                        event = self._in_flight[key] = threading.Event()
+                        break
+            if cached is not None:
+                return self._replay(cached, fingerprint)
+            # Outra thread está executando a mesma chave: aguarda o resultado
+            if not event.wait(max(0.0, deadline - time.monotonic())):
+                return {"error": "Requisição com esta Idempotency-Key ainda em processamento"}, 409, False
+
+        try:
+            if self.backend == 'table' and self._table_available():
+                return self._execute_table(key, fingerprint, fn, deadline)
+            body, status = fn()
+            if 200 <= status < 300:
+                self._put_local(key, fingerprint, body, status)
+            return body, status, False
+        finally:
+            with self._lock:
+                self._in_flight.pop(key).set()
+
+    def lookup_many(self, fingerprints):
+        """Respostas já gravadas: {key: (body, status, replayed)} para as chaves de
+        fingerprints ({key: fingerprint}) que existem. Não reserva nenhuma chave.
+        """
+        found = {}
+        with self._lock:
+            for key, fingerprint in fingerprints.items():
+                cached = self._get_local(key)
+                if cached is not None:
+                    found[key] = self._replay(cached, fingerprint)
+        missing = [key for key in fingerprints if key not in found]
+        if not missing or self.backend != 'table' or not self._table_available():
+            return found
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        with engine.connect() as conn:
+            rows = conn.execute(text("""
+                SELECT IdemKey, Fingerprint, StatusCode, ResponseBody, ExpiresAt
+                FROM Idempotency_Keys
+                WHERE IdemKey IN :keys AND StatusCode IS NOT NULL
+            """).bindparams(bindparam("keys", expanding=True)), {"keys": missing}).all()
+        for key, stored_fingerprint, status, body, expires_at in rows:
+            if isinstance(expires_at, str):
+                expires_at = datetime.fromisoformat(expires_at)
+            if expires_at <= now:
+                continue
+            cached = (expires_at.replace(tzinfo=timezone.utc).timestamp(), stored_fingerprint, json.loads(body), status)
+            self._put_local(key, *cached[1:], cached[0])
+            found[key] = self._replay(cached, fingerprints[key])
+        return found
+
+    def record_many(self, entries):
+        """Grava respostas já produzidas fora de execute(): [(key, fingerprint, body, status)].
+
+        Chaves que já existem na tabela (gravadas ou reservadas por outra
+        requisição) ficam como estão.
+        """
+        if not entries:
+            return
+        for key, fingerprint, body, status in entries:
+            self._put_local(key, fingerprint, body, status)
+        if self.backend != 'table' or not self._table_available():
+            return
+        expires_at = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=self.ttl)
+        with engine.begin() as conn:
+            conn.execute(text(sql_insert_ignore(
+                "Idempotency_Keys", ["IdemKey", "Fingerprint", "StatusCode", "ResponseBody", "ExpiresAt"]
+            )), [
+                {"IdemKey": key, "Fingerprint": fingerprint, "StatusCode": status,
+                 "ResponseBody": json.dumps(body), "ExpiresAt": expires_at}
+                for key, fingerprint, body, status in entries
+            ])
+
+    def _replay(self, cached, fingerprint):
+        _, stored_fingerprint, body, status = cached
+        if stored_fingerprint != fingerprint:
+            return {"error": "Idempotency-Key já utilizada em outra requisição"}, 422, False
+        return body, status, True
+
+    def _get_local(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put_local(self, key, fingerprint, body, status, expires_at=None):
+        with self._lock:
+            self._entries[key] = (expires_at or time.time() + self.ttl, fingerprint, body, status)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+
+    def _table_available(self):
+        # Sem a tabela, cai para o backend em memória (por processo) e tenta
+        # criá-la de novo a cada 30s
+        if self._table_ready:
+            return True
+        now = time.monotonic()
+        if self._table_checked_at is None or now - self._table_checked_at >= 30:
+            self._table_checked_at = now
+            self._table_ready = ensure_idempotency_table()
+            if not self._table_ready:
+                print("Idempotency_Keys indisponível; usando o backend em memória")
+        return self._table_ready
+
+    def _execute_table(self, key, fingerprint, fn, deadline):
+        select_q = text("""
+            SELECT Fingerprint, StatusCode, ResponseBody, ExpiresAt
+            FROM Idempotency_Keys
+            WHERE IdemKey = :k
+        """)
+        while True:
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            with engine.begin() as conn:
+                row = conn.execute(select_q, {"k": key}).mappings().first()
+                row = dict(row) if row is not None else None
+                if row is not None and isinstance(row['ExpiresAt'], str):
+                    row['ExpiresAt'] = datetime.fromisoformat(row['ExpiresAt'])
+                if row is not None and row['ExpiresAt'] <= now:
+                    conn.execute(text("DELETE FROM Idempotency_Keys WHERE IdemKey = :k"), {"k": key})
+                    row = None
+            if row is not None and row['StatusCode'] is not None:
+                expires_at = row['ExpiresAt'].replace(tzinfo=timezone.utc).timestamp()
+                body = json.loads(row['ResponseBody'])
+                cached = (expires_at, row['Fingerprint'], body, row['StatusCode'])
+                self._put_local(key, *cached[1:], expires_at)
+                return self._replay(cached, fingerprint)
+            if row is None:
+                try:
+                    # Reserva a chave; o INSERT concorrente de outro worker falha pela PK.
+                    # A reserva expira logo, para não prender a chave se o worker cair.
+                    with engine.begin() as conn:
+                        conn.execute(text("""
+                            INSERT INTO Idempotency_Keys (IdemKey, Fingerprint, StatusCode, ResponseBody, ExpiresAt)
+                            VALUES (:k, :fp, NULL, NULL, :exp)
+                        """), {"k": key, "fp": fingerprint, "exp": now + timedelta(seconds=self.wait_timeout * 3)})
+                    break
+                except IntegrityError:
+                    pass
+            # Chave reservada por outro worker: espera a conclusão
+            if time.monotonic() >= deadline:
+                return {"error": "Requisição com esta Idempotency-Key ainda em processamento"}, 409, False
+            time.sleep(0.05)
+
+        try:
+            body, status = fn()
+        except Exception:
+            with engine.begin() as conn:
+                conn.execute(text("DELETE FROM Idempotency_Keys WHERE IdemKey = :k"), {"k": key})
+            raise
+        with engine.begin() as conn:
+            if 200 <= status < 300:
+                conn.execute(text("""
+                    UPDATE Idempotency_Keys
+                    SET StatusCode = :status, ResponseBody = :body, ExpiresAt = :exp
+                    WHERE IdemKey = :k
+                """), {"k": key, "status": status, "body": json.dumps(body),
+                       "exp": datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=self.ttl)})
+            else:
+                conn.execute(text("DELETE FROM Idempotency_Keys WHERE IdemKey = :k"), {"k": key})
+            self._writes += 1
+            if self._writes % 500 == 0:
+                # Limpeza periódica das chaves expiradas
+                conn.execute(text("DELETE FROM Idempotency_Keys WHERE ExpiresAt < :now"),
+                             {"now": datetime.now(timezone.utc).replace(tzinfo=None)})
+        if 200 <= status < 300:
+            self._put_local(key, fingerprint, body, status)
+        return body, status, False
+
+idempotency_store = IdempotencyStore(
+    backend=IDEMPOTENCY_STORE if engine else 'memory',
+    ttl=IDEMPOTENCY_TTL_SECONDS,
+    max_keys=IDEMPOTENCY_MAX_KEYS
+)
+
+# -------------------------------------------------------------------
+# Rotas
+# -------------------------------------------------------------------
+
+@app.route('/')
+def index():
+    return render_template('index.html')
+
+@app.route('/responses')
+def responses():
+    # Servido como HTML puro (sem Jinja2), direto do cache em memória
+    return asset_cache.serve(os.path.join(app.root_path, 'templates', 'responses.html'), 'text/html')
+
+@app.route('/responses/notion')
+def responses_notion():
+    try:
+        return asset_cache.serve(os.path.join(app.root_path, 'Responses-notion.html'), 'text/html')
+    except Exception as e:
+        return f"Erro ao carregar Notion export: {e}", 500
+
+# Demo 1: OAuth Flow
+@app.route('/demo/1')
 def demo_oauth():
     return render_template('demo_oauth.html')
 
@@ -375,37 +2182,49 @@ def demo_sql_update():
         conn_error = "Nenhum DATABASE_URL configurado."
         return render_template('demo_sql_update.html', db_connected=False, db_version=None, conn_error=conn_error, result=None, seeded=None)
     else:
-        # Valida conexão e obtém versão do servidor
-        try:
-            with engine.connect() as conn:
-                ver = conn.execute(text("SELECT VERSION()")).scalar()
-                db_version = ver
-                db_connected = True
-            # Garante a existência da tabela e dados de exemplo
-            seed_info = ensure_sales_orders_exists()
-            orders = get_sales_orders()
-        except Exception as e:
-            conn_error = str(e)
-            db_connected = False
+        # Schema, seed e versão do servidor vêm do bootstrap (uma vez por processo)
+        state = ensure_schema_ready()
+        if not state['ready']:
+            conn_error = state['error']
             return render_template('demo_sql_update.html', db_connected=False, db_version=None, conn_error=conn_error, result=None, seeded=None)
+        db_version = state['db_version']
+        db_connected = True
+        seed_info = state['sales_orders']
 
     result_msg = None
     affected_rows = 0
     
     if request.method == 'POST':
         action = request.form.get('action', '').strip()
-        if action == 'reset':
+        bulk = get_bulk_update_options(request.form)
+        if action == 'reset' and bulk['chunked']:
+            try:
+                stats = chunked_update('PENDING', "Status = 'PROCESSED'",
+                                       batch_size=bulk['batch_size'], sleep_seconds=bulk['sleep_seconds'],
+                                       progress=log_bulk_progress)
+                result_msg = (f"{stats['affected']} registros PROCESSED foram resetados para PENDING "
+                              f"em {stats['batches']} lotes ({stats['retries']} retries, {stats['elapsed_seconds']}s).")
+            except SQLAlchemyError as e:
+                result_msg = f"Erro na atualização em lotes: {str(e)}"
+        elif action == 'reset':
             try:
                 with engine.begin() as conn:
-                    result = conn.execute(text("""
-                        UPDATE Sales_Orders
-                        SET Status = 'PENDING'
-                        WHERE Status = 'PROCESSED'
-                    """))
-                    affected_rows = result.rowcount
+                    affected_rows = update_order_status(conn, 'PENDING', "Status = 'PROCESSED'")
                     result_msg = f"{affected_rows} registros PROCESSED foram resetados para PENDING."
+                orders_cache.bump()
             except SQLAlchemyError as e:
                 result_msg = f"Erro de conexão: {str(e)}"
+        elif bulk['chunked']:
+            cutoff_date = request.form.get('cutoff_date')
+            try:
+                stats = chunked_update('PROCESSED', "Status = 'PENDING' AND OrderDate >= :cutoff_date",
+                                       {"cutoff_date": cutoff_date},
+                                       batch_size=bulk['batch_size'], sleep_seconds=bulk['sleep_seconds'],
+                                       progress=log_bulk_progress)
+                result_msg = (f"Sucesso! {stats['affected']} pedidos atualizados em {stats['batches']} lotes "
+                              f"({stats['retries']} retries, {stats['elapsed_seconds']}s).")
+            except SQLAlchemyError as e:
+                result_msg = f"Erro na atualização em lotes: {str(e)}"
         else:
             cutoff_date = request.form.get('cutoff_date')
             try:
@@ -413,14 +2232,11 @@ def demo_sql_update():
                     trans = conn.begin()
                     try:
                         # Query parametrizada
-                        query = text("""
-                            UPDATE Sales_Orders 
-                            SET Status = 'PROCESSED' 
-                            WHERE Status = 'PENDING' AND OrderDate >= :cutoff_date
-                        """)
-                        result = conn.execute(query, {"cutoff_date": cutoff_date})
-                        affected_rows = result.rowcount
+                        affected_rows = update_order_status(conn, 'PROCESSED',
+                                                            "Status = 'PENDING' AND OrderDate >= :cutoff_date",
+                                                            {"cutoff_date": cutoff_date})
                         trans.commit()
+                        orders_cache.bump()
                         result_msg = f"Sucesso! {affected_rows} pedidos atualizados."
                     except Exception as e:
                         trans.rollback()
@@ -428,8 +2244,13 @@ def demo_sql_update():
             except SQLAlchemyError as e:
                  result_msg = f"Erro de conexão: {str(e)}"
 
-        # Atualiza a lista após tentativa de atualização
-        orders = get_sales_orders()
+    # Uma página por vez (keyset); após um POST volta para a primeira página
+    list_status = (request.args.get('status') or '').upper() or None
+    list_cursor = request.args.get('cursor') if request.method == 'GET' else None
+    try:
+        orders_page = get_sales_orders_page(list_status, list_cursor)
+    except ValueError:
+        orders_page = get_sales_orders_page(list_status)
 
     return render_template(
         'demo_sql_update.html',
@@ -438,7 +2259,11 @@ def demo_sql_update():
         conn_error=conn_error,
         result=result_msg,
         seeded=seed_info if db_connected else None,
-        orders=orders
+        orders=orders_page['data'],
+        next_cursor=orders_page['next_cursor'],
+        list_status=list_status,
+        is_first_page=not list_cursor,
+        db_dialect=engine.dialect.name
     )
 
 # Demo 6: API Consumption
@@ -446,103 +2271,792 @@ def demo_sql_update():
 def demo_api():
     return render_template('demo_api.html')
 
+# Introspecção do banco: pool e profiler de queries deste processo
+@app.route('/api/db/stats', methods=['GET'])
+def api_db_stats():
+    if not engine:
+        return jsonify({"error": "Banco não configurado"}), 500
+    try:
+        top = max(1, min(int(request.args.get('top', 20)), 500))
+    except ValueError:
+        return jsonify({"error": "top deve ser inteiro"}), 400
+    order_by = request.args.get('order_by', 'total_ms')
+    if order_by not in ('total_ms', 'count', 'max_ms', 'avg_ms', 'rows', 'errors'):
+        return jsonify({"error": "order_by inválido"}), 400
+    stats = {"pid": os.getpid(), "dialect": engine.dialect.name, "pool": pool_status(),
+             "orders_cache": orders_cache.stats(),
+             "profiler_enabled": DB_PROFILER_ENABLED, "slow_query_ms": DB_SLOW_QUERY_MS}
+    if DB_PROFILER_ENABLED:
+        stats.update(query_profiler.snapshot(top, order_by))
+    return jsonify(stats)
+
+@app.route('/api/db/stats/reset', methods=['POST'])
+def api_db_stats_reset():
+    query_profiler.reset()
+    return jsonify({"reset": True, "pid": os.getpid()})
+
+@app.route('/api/orders/export', methods=['GET'])
+def api_orders_export():
+    if not engine:
+        return jsonify({"error": "Banco não configurado"}), 500
+    fmt = (request.args.get('format') or 'csv').lower()
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({"error": "format deve ser csv ou ndjson"}), 400
+    filters = {"status": (request.args.get('status') or '').upper() or None}
+    try:
+        for arg, key in (('from', 'date_from'), ('to', 'date_to')):
+            value = request.args.get(arg)
+            filters[key] = datetime.strptime(value, '%Y-%m-%d').date() if value else None
+    except ValueError:
+        return jsonify({"error": "from/to devem estar no formato AAAA-MM-DD"}), 400
+    ensure_schema_ready()
+    filename = f"sales_orders_{datetime.now(timezone.utc):%Y%m%d_%H%M%S}.{fmt}"
+    if fmt == 'csv':
+        body, mimetype = stream_sales_orders_csv(**filters), 'text/csv'
+    else:
+        body, mimetype = stream_sales_orders_ndjson(**filters), 'application/x-ndjson'
+    return Response(body, mimetype=mimetype, headers={
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "X-Accel-Buffering": "no"
+    })
+
+@app.route('/api/analytics/orders/daily', methods=['GET'])
+def api_analytics_orders_daily():
+    if not engine:
+        return jsonify({"error": "Banco não configurado"}), 500
+    try:
+        date_to = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') \
+            else datetime.now(timezone.utc).date()
+        date_from = datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') \
+            else date_to - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1)
+    except ValueError:
+        return jsonify({"error": "from/to devem estar no formato AAAA-MM-DD"}), 400
+    if date_from > date_to:
+        return jsonify({"error": "from deve ser anterior ou igual a to"}), 400
+    status = (request.args.get('status') or '').upper() or None
+    ensure_schema_ready()
+    try:
+        return jsonify(get_order_analytics(date_from, date_to, status))
+    except SQLAlchemyError as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/orders', methods=['GET'])
 def api_orders():
     status = request.args.get('status', 'pending').upper()
     page = int(request.args.get('page', 1) or 1)
     page_size = int(request.args.get('page_size', 20) or 20)
-    data = get_orders_page(status=status, page=page, per_page=page_size)
+    cursor = request.args.get('cursor') or None
+    try:
+        data = get_orders_page(status=status, page=page, per_page=page_size, cursor=cursor, use_cache=True)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     return jsonify(data)
 
 @app.route('/api/orders/<int:order_id>/confirm', methods=['POST'])
 def api_orders_confirm(order_id):
-    idempotency_key = request.headers.get('Idempotency-Key') or hashlib.md5(str(order_id).encode()).hexdigest()
-    try:
-        mock_api_confirm(order_id, idempotency_key)
-        return jsonify({"status": "confirmed", "order_id": order_id})
-    except requests.exceptions.HTTPError as e:
-        return jsonify({"error": str(e)}), 500
+    client_key = request.headers.get('Idempotency-Key')
+    idempotency_key = client_key or hashlib.md5(str(order_id).encode()).hexdigest()
+
+    def confirm():
+        try:
+            mock_api_confirm(order_id, idempotency_key)
+            return {"status": "confirmed", "order_id": order_id}, 200
+        except requests.exceptions.HTTPError as e:
+            return {"error": str(e)}, 500
+        except requests.exceptions.RequestException as e:
+            # Modo http: serviço de confirmação inacessível ou lento (conexão/timeout)
+            return {"error": str(e)}, 502
+
+    if not client_key:
+        # Sem chave do cliente não há o que repetir: o UPDATE condicional
+        # (WHERE Status = 'PENDING') já torna a confirmação idempotente
+        body, status = confirm()
+        return jsonify(body), status
+    body, status, replayed = idempotency_store.execute(f"confirm:{client_key}", str(order_id), confirm)
+    response = jsonify(body)
+    response.status_code = status
+    if replayed:
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+@app.route('/api/orders/confirm-batch', methods=['POST'])
+def api_orders_confirm_batch():
+    payload = request.get_json(silent=True) or {}
+    raw_items = payload.get('orders')
+    if raw_items is None:
+        raw_items = [{"order_id": oid} for oid in payload.get('order_ids', [])]
+    if not isinstance(raw_items, list) or not raw_items:
+        return jsonify({"error": "Informe 'orders' ou 'order_ids' com ao menos um pedido"}), 400
+    if len(raw_items) > CONFIRM_BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Máximo de {CONFIRM_BATCH_MAX_ITEMS} pedidos por requisição"}), 400
+    order_ids = []
+    item_keys = {}  # order_id -> chave no idempotency_store (idempotency_key do item)
+    for item in raw_items:
+        try:
+            order_id = int(item.get('order_id') if isinstance(item, dict) else item)
+        except (TypeError, ValueError):
+            return jsonify({"error": f"order_id inválido: {item!r}"}), 400
+        order_ids.append(order_id)
+        client_key = item.get('idempotency_key') if isinstance(item, dict) else None
+        if client_key:
+            item_keys.setdefault(order_id, f"confirm-batch:{client_key}")
+    if len(set(item_keys.values())) < len(item_keys):
+        return jsonify({"error": "idempotency_key repetida para pedidos diferentes"}), 400
+
+    # Itens com chave já gravada devolvem o resultado original; os demais vão ao lote
+    replays = idempotency_store.lookup_many({key: str(oid) for oid, key in item_keys.items()})
+    replayed_ids = {oid for oid, key in item_keys.items() if key in replays}
+    batch = confirm_orders_batch([oid for oid in order_ids if oid not in replayed_ids])
+    by_id = {r['order_id']: r for r in batch['results']}
+    for oid in replayed_ids:
+        body, status, _ = replays[item_keys[oid]]
+        if 200 <= status < 300:
+            by_id[oid] = {**body, "replayed": True}
+        else:
+            by_id[oid] = {"order_id": oid, "status": "error", "changed": False, "error": body["error"]}
+    idempotency_store.record_many([
+        (key, str(oid), by_id[oid], 200)
+        for oid, key in item_keys.items()
+        if oid not in replayed_ids and by_id[oid]['status'] != 'error'
+    ])
+    results = [by_id[oid] for oid in dict.fromkeys(order_ids)]
+    return jsonify({
+        "results": results,
+        "summary": {
+            "requested": len(results),
+            "changed": sum(1 for r in results if r['changed'] and not r.get('replayed')),
+            "already_processed": sum(1 for r in results if r['status'] == 'already_processed'),
+            "not_found": sum(1 for r in results if r['status'] == 'not_found'),
+            "errors": sum(1 for r in results if r['status'] == 'error'),
+            "replayed": sum(1 for r in results if r.get('replayed')),
+            "chunks": batch['chunks']
+        }
+    })
 
 @app.route('/api/orders/reset-status', methods=['POST'])
 def api_orders_reset_status():
     if not engine:
         return jsonify({"updated": 0, "message": "Banco não configurado"}), 500
+    params = dict(request.args)
+    params.update(request.get_json(silent=True) or {})
+    bulk = get_bulk_update_options(params)
+    if bulk['chunked']:
+        try:
+            stats = chunked_update('PENDING', "Status = 'PROCESSED'",
+                                   batch_size=bulk['batch_size'], sleep_seconds=bulk['sleep_seconds'],
+                                   progress=log_bulk_progress)
+            return jsonify({"updated": stats['affected'], **stats})
+        except SQLAlchemyError as e:
+            return jsonify({"updated": 0, "message": str(e)}), 500
     try:
         with engine.begin() as conn:
-            result = conn.execute(text("""
-                UPDATE Sales_Orders
-                SET Status = 'PENDING'
-                WHERE Status = 'PROCESSED'
-            """))
-            return jsonify({"updated": result.rowcount})
+            updated = update_order_status(conn, 'PENDING', "Status = 'PROCESSED'")
+        orders_cache.bump()
+        return jsonify({"updated": updated})
     except SQLAlchemyError as e:
         return jsonify({"updated": 0, "message": str(e)}), 500
 
+# Drenagem da fila de pedidos: modo sequencial (padrão) ou pool de workers
+class CircuitBreaker:
+    """Closed -> open quando a taxa de falha da janela passa do limite; após
+    open_seconds, half-open libera até half_open_probes chamadas de teste:
+    todas com sucesso fecham o circuito, qualquer falha o reabre.
+    """
+
+    def __init__(self, window=100, min_calls=50, failure_rate=0.5, open_seconds=5.0, half_open_probes=3, enabled=True):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.enabled = enabled
+        self.state = 'closed'
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self.opened_count = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        if not self.enabled:
+            return True
+        with self._lock:
+            if self.state == 'open':
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    self.rejected += 1
+                    return False
+                self.state = 'half_open'
+                self._probes_in_flight = 0
+                self._probe_successes = 0
+            if self.state == 'half_open':
+                if self._probes_in_flight >= self.half_open_probes:
+                    self.rejected += 1
+                    return False
+                self._probes_in_flight += 1
+            return True
+
+    def record(self, success):
+        if not self.enabled:
+            return
+        with self._lock:
+            if self.state == 'half_open':
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if not success:
+                    self._trip()
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_probes:
+                    self.state = 'closed'
+                    self._outcomes.clear()
+                return
+            if self.state == 'open':
+                return  # resposta atrasada de uma chamada anterior à abertura
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+                self._trip()
+
+    def _trip(self):
+        self.state = 'open'
+        self._opened_at = time.monotonic()
+        self.opened_count += 1
+        self._outcomes.clear()
+
+    def is_open(self):
+        return self.state == 'open'
+
+    def retry_in(self):
+        """Segundos até o half-open (0 se o circuito aceita chamadas)."""
+        with self._lock:
+            if self.state != 'open':
+                return 0.0
+            return max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+
+    def probe_limit(self):
+        return self.half_open_probes if self.state == 'half_open' else None
+
+    def snapshot(self):
+        with self._lock:
+            outcomes = list(self._outcomes)
+            return {
+                "enabled": self.enabled,
+                "state": self.state,
+                "window_calls": len(outcomes),
+                "window_failure_rate": round(outcomes.count(False) / len(outcomes), 3) if outcomes else 0.0,
+                "opened_count": self.opened_count,
+                "rejected": self.rejected,
+                "retry_in_seconds": round(max(0.0, self._opened_at + self.open_seconds - time.monotonic()), 2)
+                if self.state == 'open' else 0.0
+            }
+
+confirm_breaker = CircuitBreaker(CB_WINDOW, CB_MIN_CALLS, CB_FAILURE_RATE, CB_OPEN_SECONDS, CB_HALF_OPEN_PROBES, CB_ENABLED)
+
+class AdaptiveConcurrency:
+    """Limite de confirmações em voo ajustado por AIMD.
+
+    Médias móveis de erro e latência acima do alvo reduzem o limite pela metade
+    (no máximo uma vez a cada `limit` conclusões); caso contrário ele cresce
+    1/limit por conclusão, ou seja, cerca de +1 a cada rodada.
+    """
+
+    def __init__(self, max_limit, latency_target_ms=500.0, error_rate_target=0.3, enabled=True):
+        self.max_limit = max_limit
+        self.latency_target_ms = latency_target_ms
+        self.error_rate_target = error_rate_target
+        self.enabled = enabled
+        self._limit = float(max_limit)
+        self._error_ewma = 0.0
+        self._latency_ewma = None
+        self._since_decrease = max_limit
+        self.decreases = 0
+        self.min_seen = max_limit
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self):
+        return int(self._limit) if self.enabled else self.max_limit
+
+    def record(self, success, latency_ms):
+        with self._lock:
+            self._error_ewma = 0.9 * self._error_ewma + 0.1 * (0.0 if success else 1.0)
+            self._latency_ewma = latency_ms if self._latency_ewma is None else 0.9 * self._latency_ewma + 0.1 * latency_ms
+            self._since_decrease += 1
+            congested = self._error_ewma > self.error_rate_target or self._latency_ewma > self.latency_target_ms
+            if congested:
+                if self._since_decrease >= self._limit and self._limit > 1:
+                    self._limit = max(1.0, self._limit / 2)
+                    self._since_decrease = 0
+                    self.decreases += 1
+                    self.min_seen = min(self.min_seen, int(self._limit))
+            else:
+                self._limit = min(float(self.max_limit), self._limit + 1 / self._limit)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "limit": self.limit,
+                "max": self.max_limit,
+                "min_seen": self.min_seen,
+                "decreases": self.decreases,
+                "error_rate_ewma": round(self._error_ewma, 3),
+                "latency_ewma_ms": round(self._latency_ewma, 1) if self._latency_ewma is not None else None
+            }
+
+def observe_confirm(success, started, limiter=None):
+    confirm_breaker.record(success)
+    if limiter is not None:
+        limiter.record(success, (time.monotonic() - started) * 1000)
+
+def confirm_with_retry(order_id, backoff='fixed', deadline=None, limiter=None):
+    # Idempotency Key
+    idempotency_key = hashlib.md5(str(order_id).encode()).hexdigest()
+    logs = []
+    attempt = 0
+    for attempt in range(1, CONFIRM_MAX_ATTEMPTS + 1):
+        if not confirm_breaker.allow():
+            # Falha rápida: nenhuma chamada nem espera enquanto o circuito está aberto
+            logs.append(f"  -> Circuito aberto: confirmação do pedido {order_id} não enviada.")
+            metrics.inc("process_orders_orders_total", result="circuit_open")
+            return {"order_id": order_id, "success": False, "attempts": attempt - 1,
+                    "circuit_open": True, "logs": logs}
+        started = time.monotonic()
+        try:
+            # Mock Confirm Call
+            metrics.inc("process_orders_confirm_attempts_total")
+            if attempt > 1:
+                metrics.inc("process_orders_retries_total")
+            mock_api_confirm(order_id, idempotency_key)
+            observe_confirm(True, started, limiter)
+            logs.append(f"  -> Pedido {order_id} confirmado (tentativa {attempt}).")
+            metrics.inc("process_orders_orders_total", result="processed")
+            return {"order_id": order_id, "success": True, "attempts": attempt, "logs": logs}
+        except Exception as e:
+            observe_confirm(False, started, limiter)
+            logs.append(f"  -> Erro ao confirmar {order_id} (tentativa {attempt}): {str(e)}")
+            if confirm_breaker.is_open():
+                logs.append(f"  -> Circuito aberto; sem novas tentativas para {order_id}.")
+                break
+            if backoff == 'fixed':
+                time.sleep(0.5) # Backoff simulado
+                continue
+            if attempt == CONFIRM_MAX_ATTEMPTS:
+                break
+            # Backoff exponencial com jitter completo
+            delay = random.uniform(0, min(CONFIRM_BACKOFF_MAX, CONFIRM_BACKOFF_BASE * (2 ** (attempt - 1))))
+            if deadline is not None and time.monotonic() + delay > deadline:
+                logs.append(f"  -> Prazo da execução esgotado para {order_id}.")
+                break
+            time.sleep(delay)
+    logs.append(f"  -> Falha definitiva no pedido {order_id}.")
+    metrics.inc("process_orders_orders_total", result="failed")
+    return {"order_id": order_id, "success": False, "attempts": attempt, "logs": logs}
+
+def iter_pending_orders(log):
+    # Paginação por cursor: confirmar um pedido o remove do filtro PENDING,
+    # então OFFSET pularia registros. O cursor avança pela posição.
+    page = 1
+    cursor = None
+    while True:
+        log(f"Buscando página {page}...")
+        response = mock_api_get_pending(page, per_page=20, cursor=cursor)
+        orders = response.get('data', [])
+        if not orders:
+            log("Nenhum pedido encontrado nesta página.")
+            return
+        for order in orders:
+            yield order
+        if not response.get('next_cursor'):
+            return
+        cursor = response['next_cursor']
+        page += 1
+
+def drain_pending_orders(mode='sequential', max_workers=PROCESS_MAX_WORKERS, deadline_seconds=PROCESS_DEADLINE_SECONDS,
+                         limiter=None):
+    """Percorre os pedidos PENDING e confirma cada um, gerando eventos.
+
+    Eventos: {"type": "log", "message": ...} e
+    {"type": "order", "order_id", "success", "attempts", "logs"}.
+    Com o circuit breaker aberto a execução pausa até o half-open e retoma.
+    Se o circuito não volta a fechar em CB_MAX_WAIT_SECONDS de pausas seguidas
+    a execução para; os pedidos restantes ficam PENDING.
+    """
+    pending_logs = []
+    log = pending_logs.append
+    metrics.inc("process_orders_runs_total", mode=mode if mode == 'concurrent' else 'sequential')
+    deadline = time.monotonic() + deadline_seconds
+    wait_budget = [CB_MAX_WAIT_SECONDS]
+
+    def breaker_gate():
+        # (pode despachar?, mensagem de log ou None)
+        wait_seconds = confirm_breaker.retry_in()
+        if wait_seconds <= 0:
+            if confirm_breaker.state == 'closed':
+                wait_budget[0] = CB_MAX_WAIT_SECONDS  # serviço recuperado: a próxima pausa tem o prazo inteiro
+            return True, None
+        if wait_seconds > wait_budget[0] or (mode == 'concurrent' and time.monotonic() + wait_seconds > deadline):
+            return False, (f"Circuito aberto ({confirm_breaker.snapshot()['opened_count']}x nesta instância): "
+                           f"drenagem interrompida; pedidos restantes ficam PENDING.")
+        wait_budget[0] -= wait_seconds
+        time.sleep(wait_seconds)
+        return True, f"Circuito aberto: aguardou {wait_seconds:.1f}s pelo half-open."
+
+    if mode != 'concurrent':
+        for order in iter_pending_orders(log):
+            yield from ({"type": "log", "message": m} for m in pending_logs)
+            pending_logs.clear()
+            allowed, message = breaker_gate()
+            if message:
+                yield {"type": "log", "message": message}
+            if not allowed:
+                return
+            yield {"type": "log", "message": f"Processando pedido {order['id']}..."}
+            yield {"type": "order", **confirm_with_retry(order['id'])}
+        yield from ({"type": "log", "message": m} for m in pending_logs)
+        return
+
+    # Modo concorrente: no máximo limiter.limit confirmações em voo (ajustado
+    # pelo AIMD, nunca acima de max_workers) e prazo total por execução
+    # (pedidos não iniciados ficam PENDING).
+    if limiter is None:
+        limiter = AdaptiveConcurrency(max_workers, CONFIRM_LATENCY_TARGET_MS, CONFIRM_ERROR_RATE_TARGET,
+                                      ADAPTIVE_CONCURRENCY)
+
+    def dispatch_limit():
+        probes = confirm_breaker.probe_limit()
+        return min(limiter.limit, probes) if probes else limiter.limit
+
+    in_flight = set()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for order in iter_pending_orders(log):
+            yield from ({"type": "log", "message": m} for m in pending_logs)
+            pending_logs.clear()
+            if time.monotonic() >= deadline:
+                yield {"type": "log", "message": "Prazo da execução atingido; interrompendo a drenagem."}
+                break
+            while in_flight and len(in_flight) >= dispatch_limit():
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield {"type": "order", **future.result()}
+            allowed, message = breaker_gate()
+            if message:
+                yield {"type": "log", "message": message}
+            if not allowed:
+                break
+            yield {"type": "log", "message": f"Processando pedido {order['id']}..."}
+            in_flight.add(pool.submit(confirm_with_retry, order['id'], 'exponential', deadline, limiter))
+        yield from ({"type": "log", "message": m} for m in pending_logs)
+        for future in as_completed(in_flight):
+            yield {"type": "order", **future.result()}
+
+def get_process_options():
+    params = dict(request.args)
+    params.update(request.get_json(silent=True) or {})
+    mode = str(params.get('mode') or PROCESS_MODE).lower()
+    try:
+        max_workers = max(1, min(int(params.get('max_workers') or PROCESS_MAX_WORKERS), 64))
+    except (TypeError, ValueError):
+        max_workers = PROCESS_MAX_WORKERS
+    try:
+        deadline_seconds = float(params.get('deadline') or PROCESS_DEADLINE_SECONDS)
+    except (TypeError, ValueError):
+        deadline_seconds = PROCESS_DEADLINE_SECONDS
+    return {"mode": mode, "max_workers": max_workers, "deadline_seconds": deadline_seconds}
+
+def new_run_counters():
+    return {"processed": 0, "failed": 0, "attempts": 0, "short_circuited": 0}
+
+def count_order_event(counters, event):
+    counters['attempts'] += event['attempts']
+    counters['processed' if event['success'] else 'failed'] += 1
+    if event.get('circuit_open'):
+        counters['short_circuited'] += 1
+
+def new_run_limiter(options):
+    if options['mode'] != 'concurrent':
+        return None
+    return AdaptiveConcurrency(options['max_workers'], CONFIRM_LATENCY_TARGET_MS, CONFIRM_ERROR_RATE_TARGET,
+                               ADAPTIVE_CONCURRENCY)
+
+def run_summary(counters, options, started, limiter=None):
+    elapsed = time.monotonic() - started
+    done = counters['processed'] + counters['failed']
+    return {
+        **counters,
+        "mode": options['mode'],
+        "max_workers": options['max_workers'] if options['mode'] == 'concurrent' else 1,
+        "elapsed_seconds": round(elapsed, 3),
+        "orders_per_second": round(done / elapsed, 2) if elapsed > 0 else None,
+        "circuit_breaker": confirm_breaker.snapshot(),
+        "concurrency": limiter.snapshot() if limiter is not None else None
+    }
+
+def stream_process_events(options, fmt):
+    # Emite cada evento assim que acontece; só os contadores ficam em memória
+    def encode(event):
+        payload = json.dumps(event, default=str)
+        if fmt == 'sse':
+            return f"event: {event['type']}\ndata: {payload}\n\n"
+        return payload + "\n"
+
+    counters = new_run_counters()
+    limiter = new_run_limiter(options)
+    started = time.monotonic()
+    last_summary = started
+    since_summary = 0
+    try:
+        for event in drain_pending_orders(**options, limiter=limiter):
+            yield encode(event)
+            if event['type'] != 'order':
+                continue
+            count_order_event(counters, event)
+            since_summary += 1
+            now = time.monotonic()
+            if since_summary >= PROCESS_STREAM_SUMMARY_EVERY or now - last_summary >= 1.0:
+                yield encode({"type": "summary", "final": False, **run_summary(counters, options, started, limiter)})
+                last_summary = now
+                since_summary = 0
+    except Exception as e:
+        yield encode({"type": "log", "message": f"Erro geral: {str(e)}"})
+    yield encode({"type": "summary", "final": True, **run_summary(counters, options, started, limiter)})
+
 @app.route('/api/process-orders', methods=['POST'])
 def process_orders():
+    # Toda drenagem (síncrona, stream ou job) ocupa o mesmo escopo no job_store
+    token, active_id = job_store.claim(PROCESS_ORDERS_SCOPE)
+    if token is None:
+        return drain_conflict_response(active_id)
+    try:
+        response = run_process_orders_request()
+    except Exception:
+        job_store.release(PROCESS_ORDERS_SCOPE, token)
+        raise
+    # No modo stream a drenagem só termina quando a resposta é fechada
+    response.call_on_close(lambda: job_store.release(PROCESS_ORDERS_SCOPE, token))
+    return response
+
+def drain_conflict_response(active_id):
+    body = {"error": "Já existe uma drenagem em andamento"}
+    if job_store.get(active_id) is not None:
+        body["job_id"] = active_id
+    return jsonify(body), 409
+
+def run_process_orders_request():
+    options = get_process_options()
+    # Streaming opcional: ?stream=ndjson|sse ou Accept correspondente
+    stream = (request.args.get('stream') or '').lower()
+    accept = request.headers.get('Accept', '')
+    if not stream and 'application/x-ndjson' in accept:
+        stream = 'ndjson'
+    elif not stream and 'text/event-stream' in accept:
+        stream = 'sse'
+    if stream in ('ndjson', 'sse'):
+        mimetype = 'text/event-stream' if stream == 'sse' else 'application/x-ndjson'
+        return Response(
+            stream_with_context(stream_process_events(options, stream)),
+            mimetype=mimetype,
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
     logs = []
-    processed_count = 0
-    failed_count = 0
+    counters = new_run_counters()
+    limiter = new_run_limiter(options)
     processed_ids = []
     failed_ids = []
+    started = time.monotonic()
     
     try:
-        page = 1
-        while True:
-            logs.append(f"Buscando página {page}...")
-            response = mock_api_get_pending(page, per_page=20)
-            orders = response.get('data', [])
-            
-            if not orders:
-                logs.append("Nenhum pedido encontrado nesta página.")
-                break
-                
-            for order in orders:
-                order_id = order['id']
-                logs.append(f"Processando pedido {order_id}...")
-                
-                # Idempotency Key
-                idempotency_key = hashlib.md5(str(order_id).encode()).hexdigest()
-                
-                # Retry Logic
-                success = False
-                for attempt in range(1, 4):
-                    try:
-                        # Mock Confirm Call
-                        mock_api_confirm(order_id, idempotency_key)
-                        logs.append(f"  -> Pedido {order_id} confirmado (tentativa {attempt}).")
-                        success = True
-                        processed_count += 1
-                        processed_ids.append(order_id)
-                        break
-                    except Exception as e:
-                        logs.append(f"  -> Erro ao confirmar {order_id} (tentativa {attempt}): {str(e)}")
-                        time.sleep(0.5) # Backoff simulado
-                
-                if not success:
-                    logs.append(f"  -> Falha definitiva no pedido {order_id}.")
-                    failed_count += 1
-                    failed_ids.append(order_id)
-            
-            if not response.get('next_page'):
-                break
-            page = response['next_page']
-            
+        for event in drain_pending_orders(**options, limiter=limiter):
+            if event['type'] == 'log':
+                logs.append(event['message'])
+                continue
+            logs.extend(event['logs'])
+            count_order_event(counters, event)
+            (processed_ids if event['success'] else failed_ids).append(event['order_id'])
     except Exception as e:
         logs.append(f"Erro geral: {str(e)}")
-        
+
     return jsonify({
         "logs": logs,
-        "summary": {
-            "processed": processed_count,
-            "failed": failed_count
-        },
+        "summary": run_summary(counters, options, started, limiter),
         "details": {
             "processed_ids": processed_ids,
             "failed_ids": failed_ids
         }
     })
 
+# Jobs em background para a drenagem da fila (sem broker externo)
+class JobStore:
+    """Armazena jobs em memória, substituto local de um store como Redis.
+
+    Mantém no máximo max_finished jobs concluídos e impede dois jobs ativos
+    com o mesmo escopo (ex.: duas drenagens da fila PENDING).
+    """
+
+    def __init__(self, max_finished=100):
+        self.max_finished = max_finished
+        self._jobs = OrderedDict()
+        self._active_scopes = {}
+        self._lock = threading.Lock()
+
+    def create(self, kind, scope, options):
+        with self._lock:
+            if scope in self._active_scopes:
+                return None, self._active_scopes[scope]
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "id": job_id,
+                "kind": kind,
+                "scope": scope,
+                "status": "queued",
+                "options": options,
+                "counters": new_run_counters(),
+                "summary": None,
+                "recent_logs": deque(maxlen=50),
+                "error": None,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "started_at": None,
+                "finished_at": None,
+                "cancel_requested": False
+            }
+            self._active_scopes[scope] = job_id
+            self._prune()
+            return job_id, None
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._public(job) if job else None
+
+    def list(self):
+        with self._lock:
+            return [self._public(job) for job in reversed(self._jobs.values())]
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def log(self, job_id, message):
+        with self._lock:
+            self._jobs[job_id]['recent_logs'].append(message)
+
+    def count(self, job_id, event):
+        with self._lock:
+            count_order_event(self._jobs[job_id]['counters'], event)
+
+    def is_cancelled(self, job_id):
+        with self._lock:
+            return self._jobs[job_id]['cancel_requested']
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job['status'] in ('queued', 'running'):
+                job['cancel_requested'] = True
+            return self._public(job)
+
+    def finish(self, job_id, status, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(status=status, finished_at=datetime.now(timezone.utc).isoformat(), **fields)
+            self._active_scopes.pop(job['scope'], None)
+
+    def active_job(self, scope):
+        with self._lock:
+            return self._active_scopes.get(scope)
+
+    def claim(self, scope):
+        """Reserva o escopo para uma execução fora do executor (drenagem síncrona ou em stream).
+
+        Retorna (token, None) ou (None, id_ativo) se o escopo já estiver ocupado.
+        """
+        with self._lock:
+            if scope in self._active_scopes:
+                return None, self._active_scopes[scope]
+            token = f"inline-{uuid.uuid4().hex}"
+            self._active_scopes[scope] = token
+            return token, None
+
+    def release(self, scope, token):
+        with self._lock:
+            if self._active_scopes.get(scope) == token:
+                del self._active_scopes[scope]
+
+    def _prune(self):
+        finished = [jid for jid, job in self._jobs.items() if job['finished_at']]
+        for jid in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[jid]
+
+    def _public(self, job):
+        data = {k: v for k, v in job.items() if k != 'recent_logs'}
+        data['counters'] = dict(job['counters'])
+        data['recent_logs'] = list(job['recent_logs'])
+        return data
+
+job_store = JobStore()
+job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+PROCESS_ORDERS_SCOPE = "drain:PENDING"
+
+def run_process_orders_job(job_id, options):
+    if job_store.is_cancelled(job_id):
+        job_store.finish(job_id, "cancelled")
+        return
+    job_store.update(job_id, status="running", started_at=datetime.now(timezone.utc).isoformat())
+    started = time.monotonic()
+    limiter = new_run_limiter(options)
+    drain = drain_pending_orders(**options, limiter=limiter)
+    try:
+        for event in drain:
+            if event['type'] == 'log':
+                job_store.log(job_id, event['message'])
+            else:
+                job_store.count(job_id, event)
+                for message in event['logs']:
+                    job_store.log(job_id, message)
+            if job_store.is_cancelled(job_id):
+                # Fechar o gerador aguarda as confirmações já em voo
+                drain.close()
+                job_store.log(job_id, "Job cancelado.")
+                break
+    except Exception as e:
+        job_store.finish(job_id, "failed", error=str(e))
+        return
+    finally:
+        counters = job_store.get(job_id)['counters']
+        job_store.update(job_id, summary=run_summary(counters, options, started, limiter))
+    job_store.finish(job_id, "cancelled" if job_store.is_cancelled(job_id) else "completed")
+
+@app.route('/api/jobs/process-orders', methods=['POST'])
+def api_jobs_process_orders():
+    options = get_process_options()
+    job_id, active_id = job_store.create("process-orders", PROCESS_ORDERS_SCOPE, options)
+    if job_id is None:
+        return drain_conflict_response(active_id)
+    job_executor.submit(run_process_orders_job, job_id, options)
+    return jsonify({"job_id": job_id, "status": "queued", "status_url": url_for('api_job_status', job_id=job_id)}), 202
+
+@app.route('/api/jobs', methods=['GET'])
+def api_jobs():
+    return jsonify({"jobs": job_store.list()})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def api_job_status(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job não encontrado"}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def api_job_cancel(job_id):
+    job = job_store.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Job não encontrado"}), 404
+    return jsonify(job)
+
 # Demo 7: Normalization
 @app.route('/demo/7', methods=['GET', 'POST'])
 def demo_normalization():
@@ -560,6 +3074,127 @@ def demo_normalization():
             
     return render_template('demo_normalization.html', output=output, input_text=input_text)
 
+# Normalização em streaming: NDJSON ou array JSON lido aos poucos do corpo
+def iter_body_records(stream, chunk_size=65536, max_record_size=None):
+    """Gera ("record", obj) ou ("invalid", mensagem) a partir do corpo.
+
+    Detecta o formato pelo primeiro caractere: '[' é array JSON (lido com
+    raw_decode conforme os bytes chegam), qualquer outro é NDJSON. Só o
+    trecho ainda não consumido fica em memória: se ele passar de
+    max_record_size caracteres sem formar um registro (JSON malformado no
+    array ou linha gigante), a leitura para com um "invalid".
+    """
+    max_record_size = max_record_size or NORMALIZE_MAX_RECORD_SIZE
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    mode = None
+    line_no = 0
+    eof = False
+    while not eof:
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buffer += text_decoder.decode(chunk or b'', final=eof)
+        if mode is None:
+            stripped = buffer.lstrip()
+            if not stripped:
+                continue
+            mode = 'array' if stripped[0] == '[' else 'ndjson'
+            buffer = stripped[1:] if mode == 'array' else stripped
+
+        if mode == 'ndjson':
+            lines = buffer.split('\n')
+            buffer = '' if eof else lines.pop()
+            for line in lines:
+                line_no += 1
+                if not line.strip():
+                    continue
+                try:
+                    yield "record", json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield "invalid", f"linha {line_no}: {e.msg}"
+            if len(buffer) > max_record_size:
+                yield "invalid", f"linha {line_no + 1}: mais de {max_record_size} caracteres"
+                return
+            continue
+
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if buffer[pos] == ']':
+                mode = 'done'
+                pos = len(buffer)
+                break
+            try:
+                obj, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                if eof:
+                    yield "invalid", f"JSON inválido na posição {e.pos}: {e.msg}"
+                    pos = len(buffer)
+                break  # objeto incompleto: espera mais bytes
+            if end == len(buffer) and not eof and not isinstance(obj, (dict, list)):
+                break  # escalar pode continuar no próximo bloco
+            yield "record", obj
+            pos = end
+        buffer = buffer[pos:]
+        if mode == 'done':
+            return
+        if len(buffer) > max_record_size:
+            # Um elemento malformado nunca fecha: não acumula o resto do corpo até o EOF
+            try:
+                decoder.raw_decode(buffer)
+                message = f"elemento com mais de {max_record_size} caracteres"
+            except json.JSONDecodeError as e:
+                message = f"JSON inválido na posição {e.pos}: {e.msg}"
+            yield "invalid", message
+            return
+
+@app.route('/api/users/normalize', methods=['POST'])
+def api_users_normalize():
+    """Normaliza usuários (semântica de normalize_users) em streaming NDJSON.
+
+    Cada linha da resposta é um registro normalizado; a última é
+    {"summary": {...}} com os IDs rejeitados (limitados a NORMALIZE_MAX_REJECTED).
+    """
+    stream = request.stream
+
+    def generate():
+        received = normalized = rejected = 0
+        rejected_ids = []
+        errors = []
+        for kind, item in iter_body_records(stream):
+            received += 1
+            record = None
+            error = item if kind == "invalid" else None
+            if kind == "record" and isinstance(item, dict):
+                try:
+                    record = normalize_user(item)
+                except Exception as e:
+                    error = str(e)
+            if error and len(errors) < NORMALIZE_MAX_REJECTED:
+                errors.append(error)
+            if record is None:
+                rejected += 1
+                if len(rejected_ids) < NORMALIZE_MAX_REJECTED:
+                    rejected_ids.append(item.get('id') if isinstance(item, dict) else None)
+                continue
+            normalized += 1
+            yield json.dumps(record, ensure_ascii=False) + "\n"
+        yield json.dumps({"summary": {
+            "received": received,
+            "normalized": normalized,
+            "rejected": rejected,
+            "rejected_ids": rejected_ids,
+            "rejected_ids_truncated": rejected > len(rejected_ids),
+            "errors": errors
+        }}, ensure_ascii=False, default=str) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # Demo 8: Deep Key Map
 @app.route('/demo/8', methods=['GET', 'POST'])
 def demo_deepkey():
@@ -580,6 +3215,486 @@ def demo_deepkey():
             
     return render_template('demo_deepkey.html', output=output, input_text=input_text, max_depth=max_depth)
 
+@app.route('/api/deep-key-map', methods=['POST'])
+def api_deep_key_map():
+    # Corpo: o próprio documento JSON; ?max_depth=N opcional (padrão: sem limite)
+    data = request.get_json(silent=True)
+    if data is None:
+        return jsonify({"error": "Corpo JSON inválido ou ausente"}), 400
+    try:
+        max_depth = int(request.args['max_depth']) if request.args.get('max_depth') else None
+    except ValueError:
+        return jsonify({"error": "max_depth deve ser inteiro"}), 400
+    try:
+        return jsonify(deep_key_map_iter(data, snake_to_camel_cached, max_depth=max_depth))
+    except (AttributeError, TypeError) as e:
+        return jsonify({"error": f"Chave não suportada por snake_to_camel: {e}"}), 400
+
+# Pergunta 3: CTE recursiva sobre Relacionamentos
+def get_relationship_chain(user_id, depth_limit=5):
+    with engine.connect() as conn:
+        query = text(f"""
+            WITH RECURSIVE relationship_chain AS (
+                SELECT 
+                    id_origem AS start_id,
+                    id_origem AS current_id,
+                    id_destino AS next_id,
+                    tipo_relacao,
+                    1 AS depth,
+                    {sql_cast_text('id_origem')} AS path
+                FROM Relacionamentos
+                WHERE id_origem = :user_id
+                
+                UNION ALL
+                
+                SELECT 
+                    rc.start_id,
+                    rc.next_id AS current_id,
+                    r.id_destino AS next_id,
+                    r.tipo_relacao,
+                    rc.depth + 1,
+                    {sql_concat('rc.path', "'->'", 'r.id_destino')}
+                FROM relationship_chain rc
+                JOIN Relacionamentos r ON rc.next_id = r.id_origem
+                WHERE rc.depth < :max_depth
+            )
+            SELECT * FROM relationship_chain;
+        """)
+        result_proxy = conn.execute(query, {"user_id": user_id, "max_depth": depth_limit})
+        return [dict(row) for row in result_proxy.mappings()]
+
+def get_user_summary(user_id):
+    # Leitura de uma linha em Relacionamentos_Degree (mantida a cada escrita de aresta)
+    with engine.connect() as conn:
+        summary_result = conn.execute(text("""
+            SELECT usuario, saidas, entradas, total_conexoes
+            FROM Relacionamentos_Degree
+            WHERE usuario = :user_id
+        """), {"user_id": user_id}).mappings().first()
+        return dict(summary_result) if summary_result else None
+
+def apply_degree_deltas(conn, edges, sign=1):
+    """Soma (ou subtrai, sign=-1) as arestas em Relacionamentos_Degree na transação do chamador."""
+    deltas = {}
+    for edge in edges:
+        deltas.setdefault(int(edge["id_origem"]), [0, 0])[0] += sign
+        deltas.setdefault(int(edge["id_destino"]), [0, 0])[1] += sign
+    # Upsert atômico: dois workers criando a primeira aresta do mesmo usuário não
+    # colidem na PK. Ordem fixa dos usuários evita deadlock entre lotes concorrentes
+    upsert = text(sql_upsert_add("Relacionamentos_Degree", ["usuario"], ["saidas", "entradas", "total_conexoes"]))
+    users = sorted(deltas)
+    for i in range(0, len(users), 500):
+        chunk = users[i:i + 500]
+        conn.execute(upsert, [
+            {"usuario": u, "saidas": deltas[u][0], "entradas": deltas[u][1],
+             "total_conexoes": deltas[u][0] + deltas[u][1]}
+            for u in chunk
+        ])
+        if sign < 0:
+            stmt = text("""
+                DELETE FROM Relacionamentos_Degree WHERE usuario IN :users AND total_conexoes <= 0
+            """).bindparams(bindparam("users", expanding=True))
+            conn.execute(stmt, {"users": chunk})
+
+def rebuild_degrees(conn):
+    conn.execute(text("DELETE FROM Relacionamentos_Degree"))
+    conn.execute(text("""
+        INSERT INTO Relacionamentos_Degree (usuario, saidas, entradas, total_conexoes)
+        SELECT usuario, SUM(saidas), SUM(entradas), SUM(saidas + entradas)
+        FROM (
+            SELECT id_origem AS usuario, COUNT(*) AS saidas, 0 AS entradas
+            FROM Relacionamentos GROUP BY id_origem
+            UNION ALL
+            SELECT id_destino AS usuario, 0 AS saidas, COUNT(*) AS entradas
+            FROM Relacionamentos GROUP BY id_destino
+        ) AS combined
+        GROUP BY usuario
+    """))
+    return conn.execute(text("SELECT COUNT(*) FROM Relacionamentos_Degree")).scalar()
+
+def get_top_connected(limit=10, order_by="total_conexoes"):
+    # order_by vem de uma lista fechada (cada coluna tem índice próprio)
+    with engine.connect() as conn:
+        return [dict(r) for r in conn.execute(text(f"""
+            SELECT usuario, saidas, entradas, total_conexoes
+            FROM Relacionamentos_Degree
+            ORDER BY {order_by} DESC, usuario
+            LIMIT :limit
+        """), {"limit": limit}).mappings()]
+
+# Índice de adjacência em memória para /demo/3 (alternativa à CTE)
+class GraphIndex:
+    """Adjacência de Relacionamentos carregada uma vez por processo.
+
+    Escritas feitas por add_relationship/remove_relationship atualizam o
+    índice na hora; escritas de outros processos (outros workers, CLI) são
+    vistas após ttl segundos, quando o índice é recarregado.
+    """
+
+    def __init__(self, ttl=60.0, max_rows=100000):
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._adjacency = None   # id_origem -> [(id, id_destino, tipo_relacao), ...]
+        self._edges = {}         # id -> (id_origem, id_destino, tipo_relacao)
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._adjacency = None
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._adjacency is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return self._adjacency
+        adjacency = {}
+        edges = {}
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(text("""
+                SELECT id, id_origem, id_destino, tipo_relacao
+                FROM Relacionamentos
+                ORDER BY id
+            """))
+            for edge_id, origem, destino, tipo in result:
+                adjacency.setdefault(origem, []).append((edge_id, destino, tipo))
+                edges[edge_id] = (origem, destino, tipo)
+        with self._lock:
+            self._adjacency, self._edges = adjacency, edges
+            self._loaded_at = time.monotonic()
+            return adjacency
+
+    def add_edge(self, edge_id, origem, destino, tipo):
+        with self._lock:
+            if self._adjacency is None or edge_id in self._edges:
+                return
+            # Copy-on-write da lista: leituras em andamento não veem a mudança pela metade
+            self._adjacency[origem] = self._adjacency.get(origem, []) + [(edge_id, destino, tipo)]
+            self._edges[edge_id] = (origem, destino, tipo)
+
+    def remove_edge(self, edge_id):
+        with self._lock:
+            if self._adjacency is None or edge_id not in self._edges:
+                return
+            origem, _, _ = self._edges.pop(edge_id)
+            self._adjacency[origem] = [e for e in self._adjacency.get(origem, []) if e[0] != edge_id]
+
+    def traverse(self, start_id, max_depth=5, relation_types=None, dedupe=True):
+        """Linhas no formato da CTE de /demo/3 + contagens de alcance.
+
+        dedupe=True expande cada usuário uma única vez (conjunto de visitados),
+        o que elimina a explosão causada por ciclos; dedupe=False enumera
+        todos os caminhos, como a CTE. O path segue a mesma montagem da CTE.
+        """
+        adjacency = self._ensure_loaded()
+        start_id = int(start_id)
+        rows = []
+        truncated = False
+        visited = {start_id}
+        reached_by_depth = {}
+        # Fronteira: (nó atual, path da linha que chegou nele, profundidade)
+        frontier = [(start_id, None, 0)]
+        while frontier and not truncated:
+            next_frontier = []
+            for node, node_path, depth in frontier:
+                if depth >= max_depth:
+                    continue
+                for _, destino, tipo in adjacency.get(node, ()):
+                    if relation_types and tipo not in relation_types:
+                        continue
+                    path = str(start_id) if node_path is None else f"{node_path}->{destino}"
+                    rows.append({
+                        "start_id": start_id,
+                        "current_id": node,
+                        "next_id": destino,
+                        "tipo_relacao": tipo,
+                        "depth": depth + 1,
+                        "path": path
+                    })
+                    if len(rows) >= self.max_rows:
+                        truncated = True
+                        break
+                    if dedupe:
+                        if destino in visited:
+                            continue
+                        visited.add(destino)
+                        reached_by_depth[depth + 1] = reached_by_depth.get(depth + 1, 0) + 1
+                    next_frontier.append((destino, path, depth + 1))
+                if truncated:
+                    break
+            frontier = next_frontier
+        if not dedupe:
+            seen = {start_id}
+            for row in rows:
+                if row["next_id"] not in seen:
+                    seen.add(row["next_id"])
+                    reached_by_depth[row["depth"]] = reached_by_depth.get(row["depth"], 0) + 1
+        reach = {
+            "reachable": sum(reached_by_depth.values()),
+            "by_depth": dict(sorted(reached_by_depth.items())),
+            "truncated": truncated
+        }
+        return rows, reach
+
+graph_index = GraphIndex(ttl=GRAPH_INDEX_TTL_SECONDS)
+
+# Fecho transitivo: alcance e menor número de saltos em uma busca indexada
+CLOSURE_LOCK_NAME = "relacionamentos_closure"
+
+def acquire_app_lock(conn, name):
+    """Trava a linha name de App_Locks até o fim da transação do chamador.
+
+    No MariaDB é um lock de linha (outros workers esperam no mesmo UPDATE);
+    no SQLite o UPDATE pega o lock de escrita do banco já no início da transação.
+    """
+    lock_row = text("UPDATE App_Locks SET Name = Name WHERE Name = :name")
+    if conn.execute(lock_row, {"name": name}).rowcount == 0:
+        # Linha ausente: outro worker pode criá-la ao mesmo tempo, então insere sem
+        # conflito e trava de novo
+        conn.execute(text(sql_insert_ignore("App_Locks", ["Name"])), {"Name": name})
+        conn.execute(lock_row, {"name": name})
+
+def fetch_successors(conn, nodes, tipo, cache):
+    """Preenche cache[node] = {destinos} para os nós ainda não consultados."""
+    missing = [n for n in nodes if n not in cache]
+    for i in range(0, len(missing), 500):
+        chunk = missing[i:i + 500]
+        for n in chunk:
+            cache[n] = set()
+        sql = "SELECT id_origem, id_destino FROM Relacionamentos WHERE id_origem IN :nodes"
+        params = {"nodes": chunk}
+        if tipo != CLOSURE_ANY_TYPE:
+            sql += " AND tipo_relacao = :tipo"
+            params["tipo"] = tipo
+        stmt = text(sql).bindparams(bindparam("nodes", expanding=True))
+        for origem, destino in conn.execute(stmt, params):
+            cache[origem].add(destino)
+
+def closure_from_sources(conn, sources, tipo, max_depth, successors=None):
+    """BFS por nível a partir de cada origem; devolve linhas do fecho com a menor profundidade."""
+    successors = {} if successors is None else successors
+    frontiers = {src: {src} for src in sources}
+    seen = {src: {} for src in sources}  # destino -> min_depth
+    for depth in range(1, max_depth + 1):
+        if not frontiers:
+            break
+        fetch_successors(conn, {n for nodes in frontiers.values() for n in nodes}, tipo, successors)
+        next_frontiers = {}
+        for src, nodes in frontiers.items():
+            reached = seen[src]
+            new_nodes = set()
+            for n in nodes:
+                for dst in successors.get(n, ()):
+                    if dst not in reached:
+                        reached[dst] = depth
+                        new_nodes.add(dst)
+            if new_nodes:
+                next_frontiers[src] = new_nodes
+        frontiers = next_frontiers
+    return [
+        {"id_origem": src, "tipo_relacao": tipo, "id_destino": dst, "min_depth": d}
+        for src, reached in seen.items() for dst, d in reached.items()
+    ]
+
+def closure_scopes(tipo_relacao):
+    return (tipo_relacao, CLOSURE_ANY_TYPE)
+
+def closure_on_insert(conn, id_origem, id_destino, tipo_relacao):
+    """Nova aresta a->b: todo x que alcança a passa a alcançar tudo que b alcança."""
+    for tipo in closure_scopes(tipo_relacao):
+        ancestors = [(id_origem, 0)] + [tuple(r) for r in conn.execute(text("""
+            SELECT id_origem, min_depth FROM Relacionamentos_Closure
+            WHERE id_destino = :node AND tipo_relacao = :tipo AND min_depth < :max_depth
+        """), {"node": id_origem, "tipo": tipo, "max_depth": CLOSURE_MAX_DEPTH})]
+        descendants = [(id_destino, 0)] + [tuple(r) for r in conn.execute(text("""
+            SELECT id_destino, min_depth FROM Relacionamentos_Closure
+            WHERE id_origem = :node AND tipo_relacao = :tipo AND min_depth < :max_depth
+        """), {"node": id_destino, "tipo": tipo, "max_depth": CLOSURE_MAX_DEPTH})]
+        candidates = {}
+        for x, dx in ancestors:
+            for y, dy in descendants:
+                d = dx + 1 + dy
+                if d <= CLOSURE_MAX_DEPTH and d < candidates.get((x, y), d + 1):
+                    candidates[(x, y)] = d
+        if not candidates:
+            continue
+        conn.execute(text(sql_upsert_min("Relacionamentos_Closure", ["id_origem", "tipo_relacao", "id_destino"],
+                                         "min_depth")), [
+            {"id_origem": x, "tipo_relacao": tipo, "id_destino": y, "min_depth": d}
+            for (x, y), d in sorted(candidates.items())
+        ])
+
+def closure_on_delete(conn, id_origem, tipo_relacao):
+    """Aresta removida: recalcula o fecho só das origens que alcançavam id_origem."""
+    for tipo in closure_scopes(tipo_relacao):
+        affected = {id_origem} | {r[0] for r in conn.execute(text("""
+            SELECT id_origem FROM Relacionamentos_Closure
+            WHERE id_destino = :node AND tipo_relacao = :tipo AND min_depth < :max_depth
+        """), {"node": id_origem, "tipo": tipo, "max_depth": CLOSURE_MAX_DEPTH})}
+        affected = sorted(affected)
+        for i in range(0, len(affected), 500):
+            stmt = text("""
+                DELETE FROM Relacionamentos_Closure WHERE tipo_relacao = :tipo AND id_origem IN :origins
+            """).bindparams(bindparam("origins", expanding=True))
+            conn.execute(stmt, {"tipo": tipo, "origins": affected[i:i + 500]})
+        rows = closure_from_sources(conn, affected, tipo, CLOSURE_MAX_DEPTH)
+        if rows:
+            conn.execute(text(sql_upsert_min("Relacionamentos_Closure", ["id_origem", "tipo_relacao", "id_destino"],
+                                             "min_depth")), rows)
+
+def rebuild_closure(conn, progress=None):
+    """Recalcula o fecho inteiro a partir de Relacionamentos (carga inicial ou após bulk load)."""
+    acquire_app_lock(conn, CLOSURE_LOCK_NAME)
+    adjacency = {CLOSURE_ANY_TYPE: {}}
+    for origem, destino, tipo in conn.execute(text(
+            "SELECT id_origem, id_destino, tipo_relacao FROM Relacionamentos")):
+        for scope in (CLOSURE_ANY_TYPE, tipo):
+            successors = adjacency.setdefault(scope, {})
+            successors.setdefault(origem, set()).add(destino)
+            successors.setdefault(destino, set())  # nós sem saída também no cache: a BFS não volta ao banco
+    conn.execute(text("DELETE FROM Relacionamentos_Closure"))
+    total = 0
+    for tipo, successors in adjacency.items():
+        sources = sorted(n for n, dests in successors.items() if dests)
+        for i in range(0, len(sources), 1000):
+            rows = closure_from_sources(conn, sources[i:i + 1000], tipo, CLOSURE_MAX_DEPTH, successors=successors)
+            for j in range(0, len(rows), 5000):
+                conn.execute(relationships_closure_table.insert(), rows[j:j + 5000])
+            total += len(rows)
+            if progress:
+                progress(total)
+    return total
+
+def closure_lookup(id_origem, id_destino=None, max_depth=None, tipo_relacao=None):
+    """Alcance a partir do fecho: busca pelo prefixo da PK, sem recursão."""
+    tipo = tipo_relacao or CLOSURE_ANY_TYPE
+    with engine.connect() as conn:
+        if id_destino is not None:
+            return conn.execute(text("""
+                SELECT min_depth FROM Relacionamentos_Closure
+                WHERE id_origem = :origem AND tipo_relacao = :tipo AND id_destino = :destino
+            """), {"origem": id_origem, "tipo": tipo, "destino": id_destino}).scalar()
+        return [dict(r) for r in conn.execute(text("""
+            SELECT id_destino, min_depth FROM Relacionamentos_Closure
+            WHERE id_origem = :origem AND tipo_relacao = :tipo AND min_depth <= :max_depth
+            ORDER BY min_depth, id_destino
+        """), {"origem": id_origem, "tipo": tipo, "max_depth": max_depth or CLOSURE_MAX_DEPTH}).mappings()]
+
+def add_relationship(id_origem, id_destino, tipo_relacao):
+    with engine.begin() as conn:
+        if CLOSURE_ENABLED:
+            # Serializa a manutenção do fecho entre workers: cada um vê as arestas do anterior
+            acquire_app_lock(conn, CLOSURE_LOCK_NAME)
+        result = conn.execute(text("""
+            INSERT INTO Relacionamentos (id_origem, id_destino, tipo_relacao)
+            VALUES (:id_origem, :id_destino, :tipo_relacao)
+        """), {"id_origem": id_origem, "id_destino": id_destino, "tipo_relacao": tipo_relacao})
+        edge_id = result.lastrowid
+        apply_degree_deltas(conn, [{"id_origem": id_origem, "id_destino": id_destino}])
+        if CLOSURE_ENABLED:
+            closure_on_insert(conn, id_origem, id_destino, tipo_relacao)
+    graph_index.add_edge(edge_id, id_origem, id_destino, tipo_relacao)
+    return {"id": edge_id, "id_origem": id_origem, "id_destino": id_destino, "tipo_relacao": tipo_relacao}
+
+def remove_relationship(edge_id):
+    with engine.begin() as conn:
+        if CLOSURE_ENABLED:
+            acquire_app_lock(conn, CLOSURE_LOCK_NAME)
+        edge = conn.execute(text("""
+            SELECT id, id_origem, id_destino, tipo_relacao FROM Relacionamentos WHERE id = :id
+        """), {"id": edge_id}).mappings().first()
+        if edge is None:
+            return None
+        conn.execute(text("DELETE FROM Relacionamentos WHERE id = :id"), {"id": edge_id})
+        apply_degree_deltas(conn, [edge], sign=-1)
+        if CLOSURE_ENABLED:
+            closure_on_delete(conn, edge["id_origem"], edge["tipo_relacao"])
+    graph_index.remove_edge(edge_id)
+    return dict(edge)
+
+def parse_relation_types(raw):
+    types = {t.strip() for t in (raw or '').split(',') if t.strip()}
+    return types or None
+
+@app.route('/api/relationships', methods=['POST'])
+def api_relationships_create():
+    payload = request.get_json(silent=True) or {}
+    try:
+        id_origem = int(payload['id_origem'])
+        id_destino = int(payload['id_destino'])
+        tipo_relacao = str(payload['tipo_relacao']).strip()[:50]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "Informe id_origem, id_destino (inteiros) e tipo_relacao"}), 400
+    if not engine:
+        return jsonify({"error": "Banco não configurado"}), 500
+    try:
+        return jsonify(add_relationship(id_origem, id_destino, tipo_relacao)), 201
+    except SQLAlchemyError as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/relationships/<int:edge_id>', methods=['DELETE'])
+def api_relationships_delete(edge_id):
+    if not engine:
+        return jsonify({"error": "Banco não configurado"}), 500
+    try:
+        edge = remove_relationship(edge_id)
+    except SQLAlchemyError as e:
+        return jsonify({"error": str(e)}), 500
+    if edge is None:
+        return jsonify({"error": "Relacionamento não encontrado"}), 404
+    return jsonify({"deleted": edge})
+
+TOP_CONNECTED_ORDER = {"total": "total_conexoes", "entradas": "entradas", "saidas": "saidas"}
+
+@app.route('/api/relationships/top', methods=['GET'])
+def api_relationships_top():
+    if not engine:
+        return jsonify({"error": "Banco não configurado"}), 500
+    try:
+        limit = max(1, min(int(request.args.get('n', 10)), 1000))
+    except ValueError:
+        return jsonify({"error": "n deve ser inteiro"}), 400
+    order_by = TOP_CONNECTED_ORDER.get(request.args.get('by', 'total'))
+    if not order_by:
+        return jsonify({"error": f"by deve ser um de: {', '.join(TOP_CONNECTED_ORDER)}"}), 400
+    ensure_schema_ready()
+    return jsonify({"by": order_by, "results": get_top_connected(limit, order_by)})
+
+@app.route('/api/relationships/<int:user_id>/reach', methods=['GET'])
+def api_relationships_reach(user_id):
+    if not engine:
+        return jsonify({"error": "Banco não configurado"}), 500
+    if not CLOSURE_ENABLED:
+        return jsonify({"error": "Tabela de fecho desabilitada (CLOSURE_ENABLED=1)"}), 409
+    try:
+        to = request.args.get('to')
+        to = int(to) if to else None
+        depth = int(request.args.get('depth', CLOSURE_MAX_DEPTH))
+    except ValueError:
+        return jsonify({"error": "to e depth devem ser inteiros"}), 400
+    if depth < 1 or depth > CLOSURE_MAX_DEPTH:
+        return jsonify({"error": f"depth deve estar entre 1 e {CLOSURE_MAX_DEPTH} (CLOSURE_MAX_DEPTH)"}), 400
+    tipo = request.args.get('type') or None
+    if to is not None:
+        hops = closure_lookup(user_id, to, tipo_relacao=tipo)
+        reachable = hops is not None and hops <= depth
+        return jsonify({"from": user_id, "to": to, "type": tipo or CLOSURE_ANY_TYPE,
+                        "reachable": reachable, "hops": hops if reachable else None})
+    reached = closure_lookup(user_id, max_depth=depth, tipo_relacao=tipo)
+    return jsonify({"from": user_id, "type": tipo or CLOSURE_ANY_TYPE, "depth": depth,
+                    "reachable": len(reached), "results": reached})
+
+@app.route('/api/relationships/<int:user_id>/traverse', methods=['GET'])
+def api_relationships_traverse(user_id):
+    if not engine:
+        return jsonify({"error": "Banco não configurado"}), 500
+    try:
+        depth = max(1, min(int(request.args.get('depth', 5)), 50))
+    except ValueError:
+        return jsonify({"error": "depth deve ser inteiro"}), 400
+    dedupe = request.args.get('dedupe', '1').lower() not in ('0', 'false', 'no')
+    rows, reach = graph_index.traverse(user_id, depth, parse_relation_types(request.args.get('types')), dedupe)
+    return jsonify({"results": rows, "reach": reach})
+
 # Demo 3: Recursive CTE
 @app.route('/demo/3', methods=['GET', 'POST'])
 def demo_cte():
@@ -587,79 +3702,425 @@ def demo_cte():
         flash("Banco de dados não configurado (DATABASE_URL ausente).", "warning")
         return render_template('demo_cte.html', db_connected=False)
     
-    ensure_relationships_exists()
-        
+    ensure_schema_ready()
+
     results = None
     error = None
     depth_limit = 5
     user_summary = None
+    reach = None
+    source = request.form.get('source') or ('index' if GRAPH_INDEX_ENABLED else 'cte')
+    user_id = None
     
     if request.method == 'POST':
-        user_id = request.form.get('user_id')
+        try:
+            user_id = int(request.form.get('user_id') or '')
+        except ValueError:
+            user_id = None
+            error = "ID do usuário inválido: informe um número inteiro."
         try:
             depth_limit = int(request.form.get('depth_limit', 5))
         except (TypeError, ValueError):
             depth_limit = 5
-        try:
-            with engine.connect() as conn:
-                query = text("""
-                    WITH RECURSIVE relationship_chain AS (
-                        SELECT 
-                            id_origem AS start_id,
-                            id_origem AS current_id,
-                            id_destino AS next_id,
-                            tipo_relacao,
-                            1 AS depth,
-                            CAST(id_origem AS CHAR(200)) AS path
-                        FROM Relacionamentos
-                        WHERE id_origem = :user_id
-                        
-                        UNION ALL
-                        
-                        SELECT 
-                            rc.start_id,
-                            rc.next_id AS current_id,
-                            r.id_destino AS next_id,
-                            r.tipo_relacao,
-                            rc.depth + 1,
-                            CONCAT(rc.path, '->', r.id_destino)
-                        FROM relationship_chain rc
-                        JOIN Relacionamentos r ON rc.next_id = r.id_origem
-                        WHERE rc.depth < :max_depth
+        if user_id is not None:
+            try:
+                if source == 'index':
+                    results, reach = graph_index.traverse(
+                        user_id, depth_limit,
+                        relation_types=parse_relation_types(request.form.get('relation_types')),
+                        dedupe=request.form.get('dedupe') == '1'
                     )
-                    SELECT * FROM relationship_chain;
-                """)
-                result_proxy = conn.execute(query, {"user_id": user_id, "max_depth": depth_limit})
-                results = [dict(row) for row in result_proxy.mappings()]
-                summary_query = text("""
-                    SELECT 
-                        usuario, 
-                        SUM(saidas) AS saidas, 
-                        SUM(entradas) AS entradas, 
-                        SUM(saidas + entradas) AS total_conexoes 
-                    FROM ( 
-                        SELECT id_origem AS usuario, COUNT(*) AS saidas, 0 AS entradas 
-                        FROM Relacionamentos 
-                        WHERE id_origem = :user_id 
-                        GROUP BY id_origem 
-                        
-                        UNION ALL 
-                        
-                        SELECT id_destino AS usuario, 0 AS saidas, COUNT(*) AS entradas 
-                        FROM Relacionamentos 
-                        WHERE id_destino = :user_id 
-                        GROUP BY id_destino 
-                    ) AS combined 
-                    GROUP BY usuario 
-                    ORDER BY usuario
-                """)
-                summary_result = conn.execute(summary_query, {"user_id": user_id}).mappings().first()
-                if summary_result:
-                    user_summary = dict(summary_result)
-        except Exception as e:
-            error = f"Erro na execução SQL (Verifique se a tabela 'Relacionamentos' existe): {str(e)}"
+                else:
+                    results = get_relationship_chain(user_id, depth_limit)
+                user_summary = get_user_summary(user_id)
+            except Exception as e:
+                error = f"Erro na execução SQL (Verifique se a tabela 'Relacionamentos' existe): {str(e)}"
+
+    status = 400 if request.method == 'POST' and user_id is None else 200
+    return render_template('demo_cte.html', db_connected=True, results=results, error=error, depth_limit=depth_limit,
+                           user_summary=user_summary, reach=reach, source=source), status
+
+# Gerador de dados sintéticos em volume (CLI: flask generate-data)
+SYNTH_CUSTOMERS = ["Alice", "Bruno", "Carla", "Diego", "Eva", "Fábio", "Gisele", "Heitor", "Irene", "João",
+                   "Karina", "Lucas", "Marina", "Nuno", "Olívia", "Paulo", "Quésia", "Rafael", "Sofia", "Tiago"]
+SYNTH_RELATION_TYPES = ["amigo", "seguidor", "colega"]
+
+def parse_weights(spec):
+    # "PENDING=0.6,PROCESSED=0.4" -> (["PENDING", "PROCESSED"], [0.6, 0.4])
+    names, weights = [], []
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        names.append(name.strip())
+        weights.append(float(weight or 1))
+    return names, weights
+
+def generate_orders(count, rng, status_mix="PENDING=0.5,PROCESSED=0.5", start_date=None, end_date=None):
+    statuses, weights = parse_weights(status_mix)
+    end_date = end_date or datetime.now(timezone.utc).date()
+    start_date = start_date or end_date - timedelta(days=365)
+    span = max(0, (end_date - start_date).days)
+    for _ in range(count):
+        yield {
+            "OrderDate": (start_date + timedelta(days=rng.randint(0, span))).isoformat(),
+            "Status": rng.choices(statuses, weights)[0],
+            "CustomerName": rng.choice(SYNTH_CUSTOMERS),
+            "Amount": round(min(99999999.99, rng.lognormvariate(4.5, 1.0)), 2)
+        }
+
+def generate_edges(users, rng, fanout=3.0, cycle_ratio=0.05, relation_mix=None):
+    """Arestas com fan-out médio `fanout` por usuário.
+
+    Por padrão as arestas apontam para IDs maiores (grafo acíclico); uma
+    fração cycle_ratio aponta para trás e cria ciclos.
+    """
+    types, weights = parse_weights(relation_mix) if relation_mix else (SYNTH_RELATION_TYPES, None)
+    for origin in range(1, users + 1):
+        degree = min(users - 1, int(rng.expovariate(1.0 / fanout)) if fanout > 0 else 0)
+        for _ in range(degree):
+            if rng.random() < cycle_ratio and origin > 1:
+                dest = rng.randint(1, origin - 1)
+            elif origin < users:
+                dest = rng.randint(origin + 1, min(users, origin + max(10, int(fanout * 10))))
+            else:
+                continue
+            yield {
+                "id_origem": origin,
+                "id_destino": dest,
+                "tipo_relacao": rng.choices(types, weights)[0] if weights else rng.choice(types)
+            }
+
+def bulk_insert(table, columns, rows, chunk_size=2000, progress=None):
+    """INSERT multi-linha (VALUES (...), (...), ...) em blocos, um commit por bloco."""
+    total = 0
+    chunk = []
+
+    def flush():
+        placeholders = ", ".join(
+            "(" + ", ".join(f":{col}_{i}" for col in columns) + ")" for i in range(len(chunk))
+        )
+        params = {f"{col}_{i}": row[col] for i, row in enumerate(chunk) for col in columns}
+        with engine.begin() as conn:
+            conn.execute(text(f"INSERT INTO {table} ({', '.join(columns)}) VALUES {placeholders}"), params)
+            if table == "Relacionamentos":
+                apply_degree_deltas(conn, chunk)
+            if table == "Sales_Orders":
+                apply_order_rollup(conn, order_rollup_deltas(
+                    (row["OrderDate"], row["Status"], 1, row["Amount"]) for row in chunk
+                ))
+        if table == "Sales_Orders":
+            orders_cache.bump()
+
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            flush()
+            total += len(chunk)
+            chunk = []
+            if progress:
+                progress(total)
+    if chunk:
+        flush()
+        total += len(chunk)
+        if progress:
+            progress(total)
+    if table == "Relacionamentos":
+        graph_index.invalidate()
+    return total
+
+def load_data_infile(table, columns, rows, progress=None):
+    """Carga via LOAD DATA LOCAL INFILE (MariaDB/MySQL com local_infile habilitado)."""
+    load_engine = create_engine(DATABASE_URL, connect_args={"local_infile": True})
+    total = 0
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', newline='', encoding='utf-8', delete=False) as f:
+        writer = csv.writer(f)
+        for row in rows:
+            writer.writerow([row[col] for col in columns])
+            total += 1
+        path = f.name
+    try:
+        with load_engine.begin() as conn:
+            conn.exec_driver_sql(
+                f"LOAD DATA LOCAL INFILE '{path}' INTO TABLE {table} CHARACTER SET utf8mb4 "
+                f"FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' LINES TERMINATED BY '\\r\\n' "
+                f"({', '.join(columns)})"
+            )
+    finally:
+        os.unlink(path)
+        load_engine.dispose()
+    if table == "Relacionamentos":
+        with engine.begin() as conn:
+            rebuild_degrees(conn)
+        graph_index.invalidate()
+    if table == "Sales_Orders":
+        with engine.begin() as conn:
+            rebuild_order_rollups(conn)
+        orders_cache.bump()
+    if progress:
+        progress(total)
+    return total
+
+@app.cli.command('generate-data')
+@click.option('--orders', 'order_count', default=100000, show_default=True, help='Pedidos a gerar em Sales_Orders.')
+@click.option('--users', default=10000, show_default=True, help='Usuários (nós) do grafo de Relacionamentos.')
+@click.option('--fanout', default=3.0, show_default=True, help='Média de arestas de saída por usuário.')
+@click.option('--cycle-ratio', default=0.05, show_default=True, help='Fração de arestas que apontam para trás (ciclos).')
+@click.option('--relation-mix', default=None, help='Pesos por tipo, ex.: amigo=0.5,seguidor=0.3,colega=0.2.')
+@click.option('--status-mix', default='PENDING=0.5,PROCESSED=0.5', show_default=True, help='Pesos por status.')
+@click.option('--start-date', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='Data inicial (padrão: hoje - 365d).')
+@click.option('--end-date', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='Data final (padrão: hoje).')
+@click.option('--seed', default=42, show_default=True, help='Semente do gerador (reprodutível).')
+@click.option('--chunk-size', default=2000, show_default=True, help='Linhas por INSERT multi-linha.')
+@click.option('--load-data/--no-load-data', default=False, help='Usa LOAD DATA LOCAL INFILE quando o banco suporta.')
+@click.option('--truncate', is_flag=True, help='Limpa as tabelas antes de carregar.')
+def generate_data_command(order_count, users, fanout, cycle_ratio, relation_mix, status_mix,
+                          start_date, end_date, seed, chunk_size, load_data, truncate):
+    """Gera e carrega pedidos e arestas sintéticos em volume."""
+    if not engine:
+        raise click.ClickException("DATABASE_URL não configurado.")
+    state = bootstrap_schema()
+    if not state['ready']:
+        raise click.ClickException(f"Schema indisponível: {state['error']}")
+    if truncate:
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM Sales_Orders"))
+            conn.execute(text("DELETE FROM Sales_Orders_Daily"))
+            conn.execute(text("DELETE FROM Relacionamentos"))
+            # Contadores e fecho derivados das arestas apagadas
+            conn.execute(text("DELETE FROM Relacionamentos_Degree"))
+            conn.execute(text("DELETE FROM Relacionamentos_Closure"))
+
+    use_load_data = load_data and engine.dialect.name in ('mysql', 'mariadb')
+    if load_data and not use_load_data:
+        click.echo("LOAD DATA indisponível neste banco; usando INSERT multi-linha.")
+
+    def loader(table, columns, rows, label):
+        started = time.monotonic()
+
+        def progress(done):
+            rate = done / max(time.monotonic() - started, 1e-9)
+            click.echo(f"  {label}: {done} linhas ({rate:,.0f}/s)")
+        if use_load_data:
+            return load_data_infile(table, columns, rows, progress=progress)
+        every = max(1, 50000 // chunk_size)
+        counter = {"n": 0}
+
+        def throttled(done):
+            counter["n"] += 1
+            if counter["n"] % every == 0:
+                progress(done)
+        total = bulk_insert(table, columns, rows, chunk_size=chunk_size, progress=throttled)
+        progress(total)
+        return total
+
+    rng = random.Random(seed)
+    click.echo(f"Gerando {order_count} pedidos (seed={seed})...")
+    loader("Sales_Orders", ["OrderDate", "Status", "CustomerName", "Amount"],
+           generate_orders(order_count, rng, status_mix,
+                           start_date.date() if start_date else None, end_date.date() if end_date else None),
+           "Sales_Orders")
+    click.echo(f"Gerando arestas para {users} usuários (fan-out médio {fanout})...")
+    loader("Relacionamentos", ["id_origem", "id_destino", "tipo_relacao"],
+           generate_edges(users, rng, fanout, cycle_ratio, relation_mix), "Relacionamentos")
+    if CLOSURE_ENABLED:
+        click.echo("Recalculando Relacionamentos_Closure...")
+        with engine.begin() as conn:
+            click.echo(f"  {rebuild_closure(conn)} linhas no fecho")
+    click.echo("Concluído.")
+
+def normalize_ndjson_chunk(lines):
+    # Executa no processo do pool: recebe texto, devolve texto (serialização barata)
+    records = []
+    for line in lines:
+        if line.strip():
+            records.append(json.loads(line))
+    normalized = normalize_users(records)
+    output = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in normalized)
+    return output, len(records), len(normalized)
+
+def iter_line_chunks(f, chunk_size):
+    chunk = []
+    for line in f:
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+@app.cli.command('normalize-users')
+@click.argument('input_path', type=click.Path(exists=True, dir_okay=False))
+@click.argument('output_path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--workers', default=None, type=int, help='Processos do pool (padrão: núcleos da máquina).')
+@click.option('--chunk-size', default=NORMALIZE_CHUNK_SIZE, show_default=True, help='Registros por bloco.')
+def normalize_users_command(input_path, output_path, workers, chunk_size):
+    """Normaliza um dump de usuários (array JSON ou NDJSON) para NDJSON."""
+    workers = workers or os.cpu_count() or 1
+    with open(input_path, 'r', encoding='utf-8') as f:
+        first = f.read(1)
+        while first and first.isspace():
+            first = f.read(1)
+    started = time.perf_counter()
+    total_in = total_out = 0
+    with open(output_path, 'w', encoding='utf-8') as out:
+        if first == '[':
+            # Array JSON precisa ser carregado inteiro; a normalização vai para o pool
+            with open(input_path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+            normalized, stats = normalize_users_batch(records, workers=workers, chunk_size=chunk_size)
+            for record in normalized:
+                out.write(json.dumps(record, ensure_ascii=False) + '\n')
+            total_in, total_out = stats['input'], stats['output']
+        else:
+            # NDJSON: blocos de linhas vão para o pool com no máximo 2 blocos por
+            # worker em voo, e a saída é escrita na ordem de entrada
+            with open(input_path, 'r', encoding='utf-8') as f, \
+                    ProcessPoolExecutor(max_workers=workers) as pool:
+                pending = deque()
+                for chunk in iter_line_chunks(f, chunk_size):
+                    pending.append(pool.submit(normalize_ndjson_chunk, chunk))
+                    while len(pending) >= workers * 2:
+                        text_out, n_in, n_out = pending.popleft().result()
+                        out.write(text_out)
+                        total_in += n_in
+                        total_out += n_out
+                while pending:
+                    text_out, n_in, n_out = pending.popleft().result()
+                    out.write(text_out)
+                    total_in += n_in
+                    total_out += n_out
+    elapsed = time.perf_counter() - started
+    rate = total_in / elapsed if elapsed > 0 else 0
+    click.echo(f"{total_in} registros lidos, {total_out} normalizados, {total_in - total_out} rejeitados "
+               f"em {elapsed:.2f}s ({rate:,.0f} registros/s, {workers} workers).")
+
+@app.cli.command('rebuild-closure')
+def rebuild_closure_command():
+    """Recalcula Relacionamentos_Closure a partir de Relacionamentos."""
+    if not engine:
+        raise click.ClickException("DATABASE_URL não configurado.")
+    state = bootstrap_schema()
+    if not state['ready']:
+        raise click.ClickException(f"Schema indisponível: {state['error']}")
+    started = time.monotonic()
+    with engine.begin() as conn:
+        total = rebuild_closure(conn, progress=lambda done: click.echo(f"  {done} linhas"))
+    click.echo(f"Fecho recalculado: {total} linhas em {time.monotonic() - started:.1f}s "
+               f"(profundidade máxima {CLOSURE_MAX_DEPTH}).")
+    if not CLOSURE_ENABLED:
+        click.echo("Aviso: CLOSURE_ENABLED não está ativo; escritas não manterão o fecho.")
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recalcula Sales_Orders_Daily a partir de Sales_Orders."""
+    if not engine:
+        raise click.ClickException("DATABASE_URL não configurado.")
+    state = bootstrap_schema()
+    if not state['ready']:
+        raise click.ClickException(f"Schema indisponível: {state['error']}")
+    with engine.begin() as conn:
+        click.echo(f"Rollup diário recalculado: {rebuild_order_rollups(conn)} linhas (data, status).")
+
+@app.cli.command('rebuild-degrees')
+def rebuild_degrees_command():
+    """Recalcula Relacionamentos_Degree a partir de Relacionamentos."""
+    if not engine:
+        raise click.ClickException("DATABASE_URL não configurado.")
+    state = bootstrap_schema()
+    if not state['ready']:
+        raise click.ClickException(f"Schema indisponível: {state['error']}")
+    with engine.begin() as conn:
+        click.echo(f"Graus recalculados para {rebuild_degrees(conn)} usuários.")
+
+# Servidor local que faz o papel do serviço externo de confirmação
+def make_confirm_server(host="127.0.0.1", port=5055, latency_ms=50.0, jitter_ms=0.0, failure_rate=0.0):
+    """POST /orders/<id>/confirm com latência e taxa de falha configuráveis.
+
+    HTTP/1.1 com keep-alive; GET /stats informa requisições e conexões TCP
+    abertas (requisições/conexões = reaproveitamento do pool do cliente).
+    """
+    stats = {"requests": 0, "connections": 0, "failures": 0}
+    stats_lock = threading.Lock()
+    rng = random.Random()
+
+    class ConfirmHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            # Cabeçalho e corpo saem em writes separados: sem TCP_NODELAY o Nagle + ACK
+            # atrasado somaria ~40 ms a cada resposta e mascararia a latência configurada
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with stats_lock:
+                stats["connections"] += 1
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                with stats_lock:
+                    return self._send(200, dict(stats))
+            self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                self.rfile.read(length)
+            parts = self.path.strip("/").split("/")
+            if len(parts) != 3 or parts[0] != "orders" or parts[2] != "confirm" or not parts[1].isdigit():
+                return self._send(404, {"error": "not found"})
+            delay = max(0.0, latency_ms + rng.uniform(-jitter_ms, jitter_ms)) / 1000
+            time.sleep(delay)
+            failed = rng.random() < failure_rate
+            with stats_lock:
+                stats["requests"] += 1
+                stats["failures"] += failed
+            if failed:
+                return self._send(500, {"error": "falha simulada"})
+            self._send(200, {"status": "confirmed", "order_id": int(parts[1])})
+
+    server = ThreadingHTTPServer((host, port), ConfirmHandler)
+    server.daemon_threads = True
+    server.stats = stats
+    return server
+
+@app.cli.command('confirm-server')
+@click.option('--host', default='127.0.0.1', show_default=True)
+@click.option('--port', default=5055, show_default=True)
+@click.option('--latency-ms', default=50.0, show_default=True, help='Latência média por confirmação.')
+@click.option('--jitter-ms', default=10.0, show_default=True, help='Variação uniforme (+/-) da latência.')
+@click.option('--failure-rate', default=0.2, show_default=True, help='Fração de respostas 500.')
+def confirm_server_command(host, port, latency_ms, jitter_ms, failure_rate):
+    """Sobe o serviço de confirmação local (use com CONFIRM_CLIENT_MODE=http)."""
+    server = make_confirm_server(host, port, latency_ms, jitter_ms, failure_rate)
+    click.echo(f"Serviço de confirmação em http://{host}:{port} "
+               f"(latência {latency_ms}±{jitter_ms} ms, falhas {failure_rate:.0%}). Ctrl+C para sair.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        click.echo(f"Encerrado: {server.stats}")
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Aplica as migrations pendentes e semeia as tabelas vazias."""
+    state = bootstrap_schema()
+    print(json.dumps({k: v for k, v in state.items() if k != 'checked_at'}, default=str, indent=2))
 
-    return render_template('demo_cte.html', db_connected=True, results=results, error=error, depth_limit=depth_limit, user_summary=user_summary)
+# Bootstrap na subida do processo (o gunicorn importa o módulo uma vez por worker)
+if engine and os.getenv("DB_BOOTSTRAP_ON_STARTUP", "1") == "1":
+    bootstrap_schema()
 
 if __name__ == '__main__':
+    reset_metrics_dir(METRICS_DIR)
     app.run(debug=True, port=5000)
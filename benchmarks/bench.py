@@ -0,0 +1,300 @@
+"""Micro-benchmarks dos helpers de transformação e das queries do app.
+
+Uso:
+    python benchmarks/bench.py                       # roda e imprime resultados
+    python benchmarks/bench.py --output out.json     # grava os resultados em JSON
+    python benchmarks/bench.py --save-baseline       # grava benchmarks/baseline.json
+    python benchmarks/bench.py --compare             # compara com o baseline (exit 1 se regrediu)
+
+Sem --database-url, usa um SQLite temporário populado com dados sintéticos
+(mesmo gerador do comando `flask generate-data`), então roda sem servidor.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="Banco a usar (padrão: SQLite temporário)")
+    parser.add_argument("--output", help="Arquivo JSON para gravar os resultados")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Arquivo de baseline")
+    parser.add_argument("--save-baseline", action="store_true", help="Grava os resultados como novo baseline")
+    parser.add_argument("--compare", action="store_true", help="Compara com o baseline e falha se houver regressão")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Tolerância de regressão (0.25 = 25%% mais lento)")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetições por caso (usa a mediana)")
+    parser.add_argument("--quick", action="store_true", help="Tamanhos menores, para CI")
+    parser.add_argument("--only", help="Reporta e compara só os casos cujo nome contém este texto")
+    return parser.parse_args()
+
+
+def measure(fn, repeat, setup=None):
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return {"median_s": statistics.median(timings), "min_s": min(timings), "repeat": repeat}
+
+
+# Geradores de entrada -------------------------------------------------------
+
+def make_users(count, rng):
+    names = ["  ana  maria ", "JOÃO silva", "pedro", "  lucas   de  souza", "Beatriz"]
+    tags = [["Admin", "dev", "DEV"], "ops, Dev , qa", [], ["x", None, "Y"], "a,b,,c"]
+    actives = [True, "yes", 0, "false", 1, None]
+    return [
+        {
+            "id": str(i) if i % 7 else i,
+            "name": rng.choice(names),
+            "email": f"  User{i}@Example.COM ",
+            "active": rng.choice(actives),
+            "tags": rng.choice(tags)
+        }
+        for i in range(count)
+    ]
+
+
+def make_document(width, depth, rng):
+    keys = ["user_id", "first_name", "last_name", "created_at", "is_active", "order_items", "total_amount"]
+    if depth == 0:
+        return rng.choice([1, "texto", None, 3.14, True])
+    doc = {}
+    for i in range(width):
+        key = keys[i % len(keys)]
+        if i % 3 == 0:
+            doc[key] = [make_document(width, depth - 1, rng) for _ in range(2)]
+        else:
+            doc[key] = make_document(width, depth - 1, rng)
+    return doc
+
+
+# Casos -----------------------------------------------------------------------
+
+def bench_transforms(app, results, sizes, repeat, rng):
+    for size in sizes["users"]:
+        users = make_users(size, rng)
+        results[f"normalize_users[{size}]"] = {
+            "size": size, **measure(lambda: app.normalize_users(users), repeat)
+        }
+    for width, depth in sizes["documents"]:
+        doc = make_document(width, depth, rng)
+        name = f"deep_key_map[w{width}xd{depth}]"
+        results[name] = {
+            "size": width * depth,
+            **measure(lambda: app.deep_key_map(doc, app.snake_to_camel), repeat)
+        }
+
+
+def load_data(app, orders, users, rng):
+    from sqlalchemy import text
+    with app.engine.begin() as conn:
+        conn.execute(text("DELETE FROM Sales_Orders"))
+        conn.execute(text("DELETE FROM Sales_Orders_Daily"))
+        conn.execute(text("DELETE FROM Relacionamentos"))
+        conn.execute(text("DELETE FROM Relacionamentos_Degree"))
+        conn.execute(text("DELETE FROM Relacionamentos_Closure"))
+    app.bulk_insert("Sales_Orders", ["OrderDate", "Status", "CustomerName", "Amount"],
+                    app.generate_orders(orders, rng, "PENDING=1"), chunk_size=2000)
+    app.bulk_insert("Relacionamentos", ["id_origem", "id_destino", "tipo_relacao"],
+                    app.generate_edges(users, rng, fanout=3.0, cycle_ratio=0.05), chunk_size=2000)
+
+
+def reset_pending(app):
+    with app.engine.begin() as conn:
+        app.update_order_status(conn, 'PENDING', "Status <> 'PENDING'")
+
+
+def bench_queries(app, results, sizes, repeat, rng):
+    orders = sizes["orders"]
+    load_data(app, orders, sizes["graph_users"], rng)
+    per_page = 20
+    deep_page = max(1, orders // per_page - 1)
+
+    results["get_orders_page[offset,page=1]"] = {
+        "size": orders, **measure(lambda: app.get_orders_page(page=1, per_page=per_page), repeat)
+    }
+    results[f"get_orders_page[offset,page={deep_page}]"] = {
+        "size": orders, **measure(lambda: app.get_orders_page(page=deep_page, per_page=per_page), repeat)
+    }
+    # Cursor obtido na mesma profundidade da página OFFSET acima
+    deep_row = app.get_orders_page(page=deep_page, per_page=per_page)["data"]
+    if deep_row:
+        cursor = app.encode_cursor(deep_row[0]["OrderDate"], deep_row[0]["id"])
+        results[f"get_orders_page[cursor,page={deep_page}]"] = {
+            "size": orders, **measure(lambda: app.get_orders_page(per_page=per_page, cursor=cursor), repeat)
+        }
+
+    for depth in sizes["cte_depths"]:
+        results[f"relationship_chain[depth={depth}]"] = {
+            "size": sizes["graph_users"], "depth": depth,
+            **measure(lambda: app.get_relationship_chain(1, depth), repeat)
+        }
+
+    # Drenagem completa (modo concorrente) sobre uma fatia limitada da fila, sem
+    # falhas simuladas nem circuit breaker: o tempo não depende do sorteio do mock
+    app.CONFIRM_LOCAL_FAILURE_RATE = 0.0
+    app.confirm_breaker = app.CircuitBreaker(enabled=False)
+    drain_orders = sizes["drain_orders"]
+    load_data(app, drain_orders, 1, rng)
+    drain = lambda: sum(1 for e in app.drain_pending_orders(mode="concurrent") if e["type"] == "order")
+    results[f"process_orders_drain[{drain_orders}]"] = {
+        "size": drain_orders, **measure(drain, max(1, repeat // 2), setup=lambda: reset_pending(app))
+    }
+
+
+def bench_http_confirm(app, results, sizes, repeat):
+    """Throughput do cliente HTTP de confirmação contra o servidor local (sem rede externa)."""
+    from concurrent.futures import ThreadPoolExecutor
+    server = app.make_confirm_server(port=0, latency_ms=sizes["http_latency_ms"], failure_rate=0.0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    app.MOCK_API_BASE_URL = f"http://127.0.0.1:{server.server_address[1]}"
+    calls = sizes["http_calls"]
+    try:
+        for workers in (1, 8):
+            def run():
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    list(pool.map(lambda i: app.confirm_order_http(i, f"bench-{i}"), range(calls)))
+            before = dict(server.stats)
+            res = measure(run, max(1, repeat // 2))
+            requests_made = server.stats["requests"] - before["requests"]
+            connections = server.stats["connections"] - before["connections"]
+            results[f"confirm_http[calls={calls},workers={workers}]"] = {
+                "size": calls, **res,
+                "calls_per_second": round(calls / res["median_s"], 1),
+                "requests_per_connection": round(requests_made / max(connections, 1), 1)
+            }
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+# Comparação ------------------------------------------------------------------
+
+def incompatible_meta(meta, baseline):
+    """Campos de meta que impedem a comparação (tamanhos e banco diferentes)."""
+    base_meta = baseline.get("meta", {})
+    return [key for key in ("quick", "dialect") if base_meta.get(key) != meta[key]]
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        if base.get("size") != current.get("size"):
+            print(f"Ignorado: {name} tem size {current.get('size')}, no baseline {base.get('size')}", file=sys.stderr)
+            continue
+        ratio = current["median_s"] / base["median_s"] if base["median_s"] else 1.0
+        current["baseline_median_s"] = base["median_s"]
+        current["ratio"] = round(ratio, 3)
+        if ratio > 1 + threshold:
+            regressions.append((name, ratio))
+    return regressions
+
+
+def main():
+    args = parse_args()
+    tmpdir = None
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        tmpdir = tempfile.mkdtemp(prefix="msf-bench-")
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    try:
+        return run(args)
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def run(args):
+    sys.path.insert(0, ROOT)
+    import app  # noqa: E402  (importa após definir DATABASE_URL)
+
+    if args.quick:
+        sizes = {"users": [1000, 10000], "documents": [(4, 3), (6, 4)], "orders": 20000,
+                 "graph_users": 2000, "cte_depths": [2, 4], "drain_orders": 100,
+                 "http_calls": 100, "http_latency_ms": 5}
+    else:
+        sizes = {"users": [1000, 10000, 100000], "documents": [(4, 3), (6, 4), (8, 5)], "orders": 200000,
+                 "graph_users": 20000, "cte_depths": [2, 4, 6, 8], "drain_orders": 500,
+                 "http_calls": 500, "http_latency_ms": 5}
+
+    rng = random.Random(42)
+    results = {}
+    bench_transforms(app, results, sizes, args.repeat, rng)
+    bench_http_confirm(app, results, sizes, args.repeat)
+    if app.engine is not None and app.schema_state["ready"]:
+        bench_queries(app, results, sizes, args.repeat, rng)
+    else:
+        print("Banco indisponível; pulando benchmarks de queries.", file=sys.stderr)
+
+    if args.only:
+        results = {k: v for k, v in results.items() if args.only in k}
+    for name, res in results.items():
+        res["median_s"] = round(res["median_s"], 6)
+        res["min_s"] = round(res["min_s"], 6)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "dialect": app.engine.dialect.name if app.engine is not None else None,
+            "quick": args.quick
+        },
+        "results": results
+    }
+
+    exit_code = 0
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"Baseline não encontrado: {args.baseline}", file=sys.stderr)
+            exit_code = 2
+        else:
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+            mismatched = incompatible_meta(report["meta"], baseline)
+            if mismatched:
+                details = ", ".join(f"{key}={report['meta'][key]} (baseline: {baseline.get('meta', {}).get(key)})"
+                                    for key in mismatched)
+                print(f"Baseline incompatível: {details}. Grave um baseline com as mesmas opções.", file=sys.stderr)
+                exit_code = 2
+            else:
+                regressions = compare(results, baseline, args.threshold)
+                for name, ratio in regressions:
+                    print(f"REGRESSÃO: {name} está {ratio:.2f}x mais lento que o baseline", file=sys.stderr)
+                exit_code = 1 if regressions else 0
+
+    for name, res in results.items():
+        extra = f"  ({res['ratio']:.2f}x baseline)" if "ratio" in res else ""
+        print(f"{name:45s} {res['median_s'] * 1000:10.3f} ms{extra}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline gravado em {args.baseline}")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,22 @@
+"""Configuração lida automaticamente pelo gunicorn (./gunicorn.conf.py).
+
+Não importa o app: o master carregá-lo equivaleria a --preload.
+"""
+import os
+import tempfile
+
+
+def on_starting(server):
+    # Snapshots de métricas da execução anterior não entram na soma do /metrics
+    # (mesmo padrão de METRICS_DIR do app.py)
+    directory = os.getenv("METRICS_DIR") or os.path.join(tempfile.gettempdir(), "msf-metrics")
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        if name.endswith((".json", ".tmp")):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass